@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import platform
+import statistics
+import sys
+import threading
+import time
+
+import numpy as np
+import websockets
+
+from utils.HandTracking.handTrack import Finger, HandTrackingMain, get_angle_3_points
+from utils.HandTracking.frameSources import SyntheticSource
+from utils.HandTracking.motionGate import Landmark
+from utils.HandTracking.poseClassifier import PoseClassifier
+from utils.Sockets import SocketServer
+from utils.Sockets.SocketSend import SendQueue
+
+# Offline microbenchmarks for the hot paths, no camera, network or remote server needed. Run from the app folder:
+#   python benchmark.py --output results.json
+#   python benchmark.py --compare results.json       (exits 1 if anything got slower than --tolerance)
+# Every benchmark runs on the same seeded synthetic hands, so runs on the same machine can be compared.
+
+
+def make_hands(count, seed=0):
+    """
+    :param count: int, number of hands
+    :param seed: int, same seed gives the same hands
+    :return: list of 21 Landmark lists, hands in random poses with each finger curled a random amount
+    """
+    rng = np.random.default_rng(seed)
+    hands = []
+    for _ in range(count):
+        wrist = np.array([0.5, 0.8])
+        landmarks = [Landmark(*wrist, 0.0)]
+        for finger in range(5):
+            # thumb off to the side, the rest fanned out above the wrist
+            direction = math.radians(-150 + 25 * finger if finger == 0 else -120 + 20 * finger)
+            point = wrist + 0.08 * np.array([math.cos(direction), math.sin(direction)])
+            curl = rng.uniform(0.05, math.radians(70 if finger == 0 else 100))
+            for joint in range(4):
+                landmarks.append(Landmark(point[0], point[1], float(rng.normal(0, 0.01))))
+                direction += curl
+                point = point + 0.04 * np.array([math.cos(direction), math.sin(direction)])
+        hands.append(landmarks)
+    return hands
+
+
+def summarise(times, operations=1):
+    """
+    :param times: list of seconds per batch
+    :param operations: int, operations in each batch
+    :return: dict of results in microseconds per operation
+    """
+    per_op = sorted(t / operations * 1e6 for t in times)
+    return {
+        "iterations": len(times) * operations,
+        "mean_us": round(statistics.fmean(per_op), 3),
+        "median_us": round(statistics.median(per_op), 3),
+        "p95_us": round(per_op[min(len(per_op) - 1, int(len(per_op) * 0.95))], 3),
+        "ops_per_sec": round(1e6 / statistics.median(per_op), 1)
+    }
+
+
+def measure(function, inputs, repeat):
+    """
+    Times function over every input, repeat times
+
+    :return: summarise() of the batches
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for value in inputs:
+            function(value)
+        times.append(time.perf_counter() - started)
+    return summarise(times, len(inputs))
+
+
+def bench_tracking(hands, repeat):
+    tracker = HandTrackingMain(SyntheticSource(count=1), headless=True)
+    fingers = [tracker.assemble_hand(hand) for hand in hands]
+    triples = [(hand[5], hand[6], hand[7]) for hand in hands]
+
+    def format_and_dump(hand):
+        formatted = tracker.get_formatted_hand_data(hand)
+        json.dumps({"Left": {"Landmarks": formatted, "Gesture": "None", "Orientation": "up"},
+                    "Right": {"Landmarks": "None", "Gesture": "None", "Orientation": "None"}})
+
+    finger_list = [(finger, hand.wrist) for hand in fingers for finger in hand.fingers]
+    return {
+        "get_angle_3_points": measure(lambda points: get_angle_3_points(*points), triples, repeat),
+        "finger_is_extended": measure(lambda pair: Finger.is_extended(*pair), finger_list, repeat),
+        "detect_gestures": measure(tracker.detect_gestures, hands, repeat),
+        "format_and_json_dumps": measure(format_and_dump, hands, repeat),
+    }
+
+
+def bench_pose_classifier(hands, repeat, examples):
+    # a library of examples hands from a different seed, so lookups aren't exact matches
+    classifier = PoseClassifier()
+    for i, hand in enumerate(make_hands(examples, seed=1)):
+        classifier.add(f"Pose{i % 20}", hand)
+    classifier.classify(hands[0])  # builds the tree
+    return {f"classify_pose_{examples}_examples": measure(classifier.classify, hands, repeat)}
+
+
+async def bench_fan_out(hands, clients, frames):
+    """
+    Time from the tracker sending a frame to the server until the last of clients subscribers has it
+    """
+    received = asyncio.Queue()
+
+    async def subscriber():
+        async with websockets.connect(uri) as websocket:
+            await websocket.send(":111")
+            ready.release()
+            async for _ in websocket:
+                received.put_nowait(time.perf_counter())
+
+    async with websockets.serve(SocketServer.echo, "127.0.0.1", 0) as server:
+        uri = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        ready = asyncio.Semaphore(0)
+        tasks = [asyncio.create_task(subscriber()) for _ in range(clients)]
+        for _ in range(clients):
+            await ready.acquire()
+
+        async with websockets.connect(uri) as sender:
+            await sender.send(":")
+            await asyncio.sleep(0.1)  # let the handshakes land
+            times = []
+            for i in range(frames):
+                landmarks = {j: {'X': lm.x, 'Y': lm.y, 'Z': lm.z} for j, lm in enumerate(hands[i % len(hands)])}
+                message = json.dumps({"Left": {"Landmarks": landmarks, "Gesture": "Open", "Orientation": "up"},
+                                      "Right": {"Landmarks": "None", "Gesture": "None", "Orientation": "None"}})
+                started = time.perf_counter()
+                await sender.send(message)
+                for _ in range(clients):
+                    last = await received.get()
+                times.append(last - started)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return summarise(times)
+
+
+def bench_send_queue(messages):
+    """
+    Rate frames can be handed from the tracker's thread to the websocket thread's loop through SendQueue
+    """
+    send_queue = SendQueue(maxsize=messages)
+    loop = asyncio.new_event_loop()
+    done = threading.Event()
+
+    async def consume():
+        send_queue.bind(asyncio.get_running_loop())
+        done.set()
+        for _ in range(messages):
+            await send_queue.get()
+
+    consumer = threading.Thread(target=loop.run_until_complete, args=(consume(),))
+    consumer.start()
+    done.wait()
+    message = {"Left": {}, "Right": {}}
+    started = time.perf_counter()
+    for _ in range(messages):
+        send_queue.put(message)
+    consumer.join()
+    elapsed = time.perf_counter() - started
+    loop.close()
+    result = summarise([elapsed], messages)
+    result["dropped"] = send_queue.dropped
+    return result
+
+
+def run(args):
+    hands = make_hands(args.hands, args.seed)
+    results = bench_tracking(hands, args.repeat)
+    results.update(bench_pose_classifier(hands, args.repeat, args.pose_examples))
+    for clients in args.clients:
+        # the server prints every connection, keep that out of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[f"echo_fan_out_{clients}_clients"] = asyncio.run(bench_fan_out(hands, clients, args.frames))
+    results["send_queue_throughput"] = bench_send_queue(args.messages)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "websockets": websockets.__version__,
+            "hands": args.hands,
+            "seed": args.seed,
+            "pose_examples": args.pose_examples,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "results": results
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    :return: list of benchmark names whose median got more than tolerance slower than in baseline
+    """
+    regressions = []
+    for name, result in report["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        change = result["median_us"] / old["median_us"] - 1
+        flag = "SLOWER" if change > tolerance else ""
+        print(f"{name:32} {old['median_us']:12.3f}us -> {result['median_us']:12.3f}us {change:+8.1%} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Hand Tracking API microbenchmarks")
+    parser.add_argument("--output", metavar="PATH", help="write the results to a json file")
+    parser.add_argument("--compare", metavar="PATH", help="compare with results saved by an earlier --output")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="with --compare, how much slower (0.2 = 20%%) counts as a regression (default: 0.2)")
+    parser.add_argument("--hands", type=int, default=500, help="synthetic hands to use (default: 500)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic hands (default: 0)")
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the hands per benchmark (default: 20)")
+    parser.add_argument("--pose-examples", type=int, default=4000,
+                        help="example poses in the pose classifier's library (default: 4000)")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 50],
+                        help="subscriber counts for the fan-out benchmark (default: 1 10 50)")
+    parser.add_argument("--frames", type=int, default=200, help="frames sent in the fan-out benchmark (default: 200)")
+    parser.add_argument("--messages", type=int, default=100000,
+                        help="messages pushed through the send queue (default: 100000)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
@@ -1,26 +1,144 @@
+import argparse
 import asyncio
 import threading
 
-from utils.HandTracking import main as start_hand_tracking
+from utils.HandTracking import LandmarkReplay
+from utils.HandTracking import FrameRateGovernor
+from utils.HandTracking import TrackerSupervisor
 from utils.Sockets import start_socket_server
 from utils.Sockets import websocket_manager
+from utils.Sockets import local_publisher
+from utils.Sockets import ServerWorkerPool
+from utils.metrics import StartupTimer, start_metrics_server
 
 
-async def run_components():
-    thread1 = threading.Thread(target=start_socket_server)
-    thread1.start()
-    # start the socket server in a separate thread without awaiting it directly
+async def run_components(frame_source=0, headless=False, record_path=None, replay_path=None, replay_speed=1.0,
+                         wire_format="json", drop_policy="drop-oldest", publish="local", server_uri=None,
+                         motion_gate=False, governor=True, tracking_interval=0.1, cameras=None,
+                         shared_capture=False, roi=False, server_workers=0, poses=None, dynamic_gestures=False,
+                         metrics_port=8766):
+    if server_workers:
+        # several server processes sharing the port, the pool is the publisher and feeds all of them
+        publisher = ServerWorkerPool(server_workers)
+        await asyncio.to_thread(publisher.start)
+        # the workers' /metrics only has the server side, the tracker's own metrics are recorded in this process
+        start_metrics_server(port=metrics_port)
+    else:
+        if server_uri is None:
+            thread1 = threading.Thread(target=start_socket_server)
+            thread1.start()
+            # start the socket server in a separate thread without awaiting it directly
 
-    # start the WebSocket thread
-    websocket_manager.start()
+        if publish == "local":
+            # hand frames straight to the server in this process, no localhost websocket hop
+            publisher = local_publisher
+            await asyncio.to_thread(publisher.start)
+        else:
+            # connect to the server over a websocket like any other client, for running the tracker on another
+            # machine
+            if server_uri is not None:
+                websocket_manager.ws_thread.client.uri = server_uri
+            # start the WebSocket thread
+            publisher = websocket_manager
+            publisher.start(wire_format, drop_policy)
 
-    # start hand tracking and pass the WebSocket manager to send messages
-    hand_tracking_task = asyncio.create_task(start_hand_tracking(websocket_manager))
+    if cameras:
+        # one tracker process per camera, all feeding the same server, clients pick cameras with ";source=<id>"
+        supervisor = TrackerSupervisor(cameras, publisher, shared_capture=shared_capture, motion_gate=motion_gate,
+                                       governor=governor, tracking_interval=tracking_interval, roi=roi,
+                                       poses=poses, dynamic_gestures=dynamic_gestures)
+        hand_tracking_task = asyncio.create_task(supervisor.run())
+    elif replay_path:
+        # replay a recorded session instead of tracking, no camera or mediapipe needed
+        hand_tracking_task = asyncio.create_task(LandmarkReplay(replay_path).replay(publisher, replay_speed))
+    else:
+        # start hand tracking and pass the publisher to send messages. imported here so replays and supervisors
+        # don't load mediapipe and cv2, and timed so the startup report includes it
+        startup = StartupTimer("tracker")
+        from utils.HandTracking import main as start_hand_tracking
+        startup.mark("imports")
+        hand_tracking_task = asyncio.create_task(
+            start_hand_tracking(publisher, frame_source, headless, record_path, motion_gate, governor,
+                                tracking_interval, roi=roi, poses=poses,
+                                dynamic_gestures=dynamic_gestures, startup=startup))
 
     # let tasks run
     await asyncio.gather(hand_tracking_task)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Hand Tracking API")
+    parser.add_argument("--source", default="0",
+                        help="camera index, video file or folder of images to track (default: camera 0)")
+    parser.add_argument("--camera", action="append", metavar="ID=SOURCE",
+                        help="track several cameras at once, each in its own process, e.g. --camera front=0 "
+                             "--camera side=1 (replaces --source, can be given more than once)")
+    parser.add_argument("--shared-capture", action="store_true",
+                        help="with --camera, capture in separate processes and hand frames to the trackers "
+                             "through shared memory")
+    parser.add_argument("--headless", action="store_true",
+                        help="don't open a preview window, for servers and CI")
+    parser.add_argument("--motion-gate", action="store_true",
+                        help="skip inference on frames where nothing moved and extrapolate the landmarks instead")
+    parser.add_argument("--roi", action="store_true",
+                        help="only run hand detection on the area around the hands, with a full frame check every "
+                             "15 frames")
+    parser.add_argument("--poses", metavar="PATH",
+                        help="pose library (see PoseClassifier) to recognise poses the gesture templates can't, "
+                             "like a pinch")
+    parser.add_argument("--dynamic-gestures", action="store_true",
+                        help="recognise swipes, circles, waves and pinch drags, sent as \"Events\" on each hand")
+    parser.add_argument("--max-fps", type=float, default=30.0,
+                        help="frame rate while hands are moving (default: 30)")
+    parser.add_argument("--idle-fps", type=float, default=5.0,
+                        help="frame rate with no hands in view (default: 5)")
+    parser.add_argument("--target-latency", type=float, default=0.1,
+                        help="seconds from capture to publish to aim for while hands are in view (default: 0.1)")
+    parser.add_argument("--cpu-budget", type=float, default=0.8,
+                        help="fraction of one core inference is allowed to use (default: 0.8)")
+    parser.add_argument("--fixed-interval", type=float, metavar="SECONDS",
+                        help="track at a fixed interval instead of adapting the frame rate")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record every published frame to a binary file")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="replay a recorded session instead of tracking")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="replay speed multiplier, 0 sends as fast as possible (default: 1)")
+    parser.add_argument("--publish", choices=["local", "socket"], default="local",
+                        help="hand frames to the server in-process, or send them over a websocket (default: local)")
+    parser.add_argument("--server-uri", metavar="URI",
+                        help="with --publish socket, send to a server somewhere else instead of starting one here")
+    parser.add_argument("--server-workers", type=int, default=0, metavar="N",
+                        help="run the socket server in N processes sharing the port, for lots of clients "
+                             "(needs SO_REUSEPORT, so not on Windows, and --publish local)")
+    parser.add_argument("--metrics-port", type=int, default=8766,
+                        help="with --server-workers, port the tracker serves its own /metrics on (default: 8766)")
+    parser.add_argument("--wire-format", choices=["json", "binary"], default="json",
+                        help="with --publish socket, format frames are sent to the server in (default: json)")
+    parser.add_argument("--drop-policy", choices=["drop-oldest", "latest-only"], default="drop-oldest",
+                        help="what to drop when frames queue up waiting for the server (default: drop-oldest)")
+    args = parser.parse_args()
+    if args.server_uri and args.publish != "socket":
+        # a local publisher only reaches a server in this process, and there isn't one with --server-uri
+        parser.error("--server-uri needs --publish socket")
+    if args.server_workers and (args.publish != "local" or args.server_uri):
+        parser.error("--server-workers needs the tracker to publish locally")
+    return args
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    cameras = dict(camera.split("=", 1) for camera in args.camera) if args.camera else None
+    tracking_interval = args.fixed_interval if args.fixed_interval is not None else 0.1
+    if args.fixed_interval is not None:
+        governor = False
+    else:
+        governor = FrameRateGovernor(max_rate=args.max_fps, present_rate=min(15.0, args.max_fps),
+                                     idle_rate=args.idle_fps, target_latency=args.target_latency,
+                                     cpu_budget=args.cpu_budget)
     # run the components
-    asyncio.run(run_components())
+    asyncio.run(run_components(args.source, args.headless, args.record, args.replay, args.replay_speed,
+                               args.wire_format, args.drop_policy, args.publish, args.server_uri,
+                               args.motion_gate, governor, tracking_interval, cameras,
+                               args.shared_capture, args.roi, args.server_workers, args.poses,
+                               args.dynamic_gestures, args.metrics_port))
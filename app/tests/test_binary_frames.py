@@ -0,0 +1,86 @@
+import json
+import unittest
+
+from app.utils.Sockets import SocketServer
+from app.utils.Sockets.BinaryFrames import HEADER, BinaryFrameDecoder, BinaryFrameEncoder
+
+
+def make_frame():
+    landmarks = {j: {'X': j / 21, 'Y': 1 - j / 21, 'Z': 0.0} for j in range(21)}
+    return {"Left": {"Landmarks": landmarks, "Gesture": "Open", "Orientation": "up"},
+            "Right": {"Landmarks": "None", "Gesture": "None", "Orientation": "None"},
+            "Sequence": 7}
+
+
+class TruncatedBinaryFrameTest(unittest.TestCase):
+
+    def setUp(self):
+        encoder = BinaryFrameEncoder()
+        self.payload = encoder.encode(make_frame())
+        self.decoder = BinaryFrameDecoder()
+        self.decoder.update_table({"Gestures": encoder.gestures})
+
+    def test_whole_frame_decodes(self):
+        frame = self.decoder.decode(self.payload)
+        self.assertEqual(frame["Left"]["Gesture"], "Open")
+        self.assertEqual(frame["Sequence"], 7)
+
+    def test_short_header_is_a_value_error(self):
+        with self.assertRaises(ValueError):
+            self.decoder.decode(self.payload[:HEADER.size - 1])
+
+    def test_missing_landmarks_is_a_value_error(self):
+        with self.assertRaises(ValueError):
+            self.decoder.decode(self.payload[:-4])
+
+    def test_server_ignores_truncated_frames(self):
+        sender = object()
+        try:
+            self.assertIsNone(SocketServer.parse_message(self.payload[:10], sender))
+            self.assertIsNone(SocketServer.parse_message(self.payload[:-4], sender))
+        finally:
+            SocketServer.frame_decoders.pop(sender, None)
+
+    def test_server_ignores_json_that_isnt_a_frame(self):
+        sender = object()
+        for message in ("42", "[1, 2]", '"Left"', "null", '{"Left": 1, "Right": 2}'):
+            self.assertIsNone(SocketServer.parse_message(message, sender))
+        self.assertIsNotNone(SocketServer.parse_message(json.dumps(make_frame()), sender))
+
+
+class BinaryFrameEventsTest(unittest.TestCase):
+
+    def test_events_round_trip(self):
+        frame = make_frame()
+        frame["Left"]["Events"] = ["Wave"]
+        frame["Right"]["Events"] = ["SwipeLeft", "PinchDrag"]
+        decoded = BinaryFrameDecoder().decode(BinaryFrameEncoder().encode(frame))
+        self.assertEqual(decoded["Left"]["Events"], ["Wave"])
+        self.assertEqual(decoded["Right"]["Events"], ["SwipeLeft", "PinchDrag"])
+
+    def test_events_go_with_the_gesture(self):
+        frame = make_frame()
+        frame["Left"]["Events"] = ["Wave"]
+        decoded = BinaryFrameDecoder().decode(BinaryFrameEncoder().encode(frame, preferences="110"))
+        self.assertNotIn("Events", decoded["Left"])
+
+
+class BinaryFrameSourceTest(unittest.TestCase):
+
+    def test_source_round_trip(self):
+        frame = make_frame()
+        frame["Source"] = "front"
+        frame["Left"]["Events"] = ["Wave"]
+        decoded = BinaryFrameDecoder().decode(BinaryFrameEncoder().encode(frame))
+        self.assertEqual(decoded["Source"], "front")
+        self.assertEqual(decoded["Left"]["Events"], ["Wave"])
+
+    def test_truncated_source_is_a_value_error(self):
+        frame = make_frame()
+        frame["Source"] = "front"
+        with self.assertRaises(ValueError):
+            BinaryFrameDecoder().decode(BinaryFrameEncoder().encode(frame)[:-2])
+
+
+if __name__ == "__main__":
+    unittest.main()
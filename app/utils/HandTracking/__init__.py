@@ -1 +1,44 @@
-from .handTrack import main
\ No newline at end of file
+import importlib
+
+# name -> module it's in. Modules are imported the first time one of their names is used, so only the tracker
+# itself (handTrack, preprocess, motionGate) loads mediapipe and cv2, and a supervisor, a replay or the governor
+# don't pay for them
+_EXPORTS = {
+    "main": ".handTrack",
+    "classify_batch": ".batchClassify",
+    "landmarks_to_array": ".batchClassify",
+    "GestureRegistry": ".gestureRegistry",
+    "GestureConflictError": ".gestureRegistry",
+    "PoseClassifier": ".poseClassifier",
+    "KDTree": ".poseClassifier",
+    "get_pose_features": ".poseClassifier",
+    "DynamicGestureDetector": ".dynamicGestures",
+    "HandHistory": ".dynamicGestures",
+    "FrameSource": ".frameSources",
+    "CameraSource": ".frameSources",
+    "VideoFileSource": ".frameSources",
+    "ImageDirectorySource": ".frameSources",
+    "SyntheticSource": ".frameSources",
+    "open_frame_source": ".frameSources",
+    "LandmarkRecorder": ".recording",
+    "LandmarkReplay": ".recording",
+    "MotionGate": ".motionGate",
+    "LandmarkExtrapolator": ".motionGate",
+    "FrameRateGovernor": ".governor",
+    "TrackerSupervisor": ".supervisor",
+    "SharedFrameRing": ".sharedFrames",
+    "SharedFrameSource": ".sharedFrames",
+    "start_capture_process": ".sharedFrames",
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value  # only looked up the first time
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
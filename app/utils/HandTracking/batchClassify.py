@@ -0,0 +1,115 @@
+import collections
+
+import numpy as np
+
+from .gestureRegistry import ORIENTATIONS, GestureRegistry
+
+# every joint angle Finger.is_extended looks at, as (point_a, point_b, point_c) landmark indices with the angle at point_b
+# the first three are the thumb (cmc, mcp, ip), the rest are the angle at the pip between the tip and the wrist
+_ANGLE_A = np.array([0, 1, 2, 8, 12, 16, 20])
+_ANGLE_B = np.array([1, 2, 3, 6, 10, 14, 18])
+_ANGLE_C = np.array([2, 3, 4, 0, 0, 0, 0])
+
+THUMB_THRESHOLD = 160
+FINGER_THRESHOLD = 90
+
+BatchClassification = collections.namedtuple("BatchClassification", ["extended", "orientation", "gesture"])
+
+
+def landmarks_to_array(landmark_lists):
+    """
+    :param landmark_lists: list of mediapipe landmark lists (hand_landmarks.landmark), one per hand
+    :return: float32 array of shape (N, 21, 3)
+    """
+    return np.array([[(lm.x, lm.y, lm.z) for lm in landmarks] for landmarks in landmark_lists],
+                    dtype=np.float32).reshape(-1, 21, 3)
+
+
+def get_angles_3_points(point_a, point_b, point_c):
+    """
+    Vectorised get_angle_3_points, same law of cosines on x and y only
+
+    :param point_a: array (..., 3) or (..., 2)
+    :param point_b: array (..., 3) or (..., 2)
+    :param point_c: array (..., 3) or (..., 2)
+    :return: angles at point_b in degrees, nan where two of the points are on top of each other
+    """
+    a = np.sqrt((point_c[..., 0] - point_b[..., 0]) ** 2 + (point_c[..., 1] - point_b[..., 1]) ** 2)
+    b = np.sqrt((point_c[..., 0] - point_a[..., 0]) ** 2 + (point_c[..., 1] - point_a[..., 1]) ** 2)
+    c = np.sqrt((point_b[..., 0] - point_a[..., 0]) ** 2 + (point_b[..., 1] - point_a[..., 1]) ** 2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cosine = (a ** 2 + c ** 2 - b ** 2) / (2 * a * c)
+    # rounding can push the cosine just past +-1, which would make math.acos throw in the scalar version
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+
+def _as_hands(hands):
+    hands = np.asarray(hands)
+    if hands.ndim == 2:
+        hands = hands[np.newaxis]
+    if hands.shape[1:] != (21, 3) and hands.shape[1:] != (21, 2):
+        raise ValueError(f"expected hands of shape (N, 21, 3), got {hands.shape}")
+    # the scalar path works on python floats, so do the maths in double precision to get the same answers
+    return hands.astype(np.float64, copy=False)
+
+
+def get_extended_fingers(hands):
+    """
+    Vectorised Finger.is_extended for every finger of every hand
+
+    :param hands: array (N, 21, 3) of landmarks
+    :return: bool array (N, 5), columns in FINGER_NAMES order
+    """
+    hands = _as_hands(hands)
+    angles = get_angles_3_points(hands[:, _ANGLE_A], hands[:, _ANGLE_B], hands[:, _ANGLE_C])
+
+    extended = np.empty((hands.shape[0], 5), dtype=bool)
+    extended[:, 0] = np.all(angles[:, :3] >= THUMB_THRESHOLD, axis=1)
+    extended[:, 1:] = angles[:, 3:] > FINGER_THRESHOLD
+    return extended
+
+
+def get_orientations(hands):
+    """
+    Vectorised Gesture.get_orientation, only looks at the middle finger mcp relative to the wrist
+
+    :param hands: array (N, 21, 3) of landmarks
+    :return: int8 array (N,) of indices into ORIENTATIONS
+    """
+    hands = _as_hands(hands)
+    dx = hands[:, 9, 0] - hands[:, 0, 0]
+    dy = hands[:, 9, 1] - hands[:, 0, 1]
+
+    vertical = np.abs(dx) < np.abs(dy)
+    return np.where(vertical,
+                    np.where(dy < 0, 0, 1),  # up, down
+                    np.where(dx > 0, 3, 2)).astype(np.int8)  # right, left
+
+
+def get_finger_masks(extended):
+    """
+    :param extended: bool array (N, 5) from get_extended_fingers
+    :return: uint8 array (N,), bit i set if finger i is extended (thumb is bit 0)
+    """
+    return (np.asarray(extended, dtype=np.uint8) << np.arange(5, dtype=np.uint8)).sum(axis=1, dtype=np.uint8)
+
+
+def classify_batch(hands, gestures):
+    """
+    Classifies N hands in one go, same answers as HandTrackingMain.detect_gestures would give one at a time
+
+    :param hands: array (N, 21, 3) of landmarks, e.g. from landmarks_to_array
+    :param gestures: GestureRegistry, or a list of Gesture templates to compile into one
+    :return: BatchClassification(extended (N, 5) bool, orientation (N,) str, gesture (N,) str)
+    """
+    if not isinstance(gestures, GestureRegistry):
+        gestures = GestureRegistry.from_gestures(gestures, strict=False)
+
+    hands = _as_hands(hands)
+    extended = get_extended_fingers(hands)
+    orientation = get_orientations(hands)
+    gesture_ids = gestures.lookup_ids(get_finger_masks(extended), orientation)
+
+    return BatchClassification(extended, np.array(ORIENTATIONS, dtype=object)[orientation],
+                               np.array(gestures.names, dtype=object)[gesture_ids])
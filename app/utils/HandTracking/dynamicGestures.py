@@ -0,0 +1,227 @@
+import math
+
+# every event a DynamicGestureDetector can emit, binary frames (Sockets.BinaryFrames.EVENTS) code them in this order
+EVENTS = ("SwipeLeft", "SwipeRight", "SwipeUp", "SwipeDown", "CircleClockwise", "CircleCounterClockwise", "Wave",
+          "PinchDrag")
+
+
+class HandHistory:
+    """
+    Class HandHistory:
+
+    Ring buffer of one hand's recent positions, and features of the whole window that are kept up to date as samples
+    come in and fall out, so adding a sample costs the same however long the window is. Positions are the middle of
+    the palm in normalised image coordinates (y goes down).
+
+    Each sample stores what it adds to the running features (the step from the sample before it, how much the
+    direction turned, whether it reversed left/right). When the oldest sample is dropped whatever the samples after
+    it measured against it is taken back out, so the features only ever cover movement inside the window.
+
+    Attributes
+    ----------
+    window : float, seconds of history kept
+    count : int, samples in the window
+    path_length : float, distance moved along the way
+    turning : float, radians the direction of movement turned, positive is clockwise on screen
+    reversals : int, times the movement changed between left and right
+    pinched : int, samples where the thumb and index fingertips were touching
+
+    Methods
+    -------
+    add(timestamp, x, y, pinched):
+        Adds the newest sample, dropping ones older than the window
+    duration(), displacement():
+        Time and (dx, dy) from the oldest sample to the newest
+    clear():
+        Forgets everything
+    """
+
+    def __init__(self, window=1.0, capacity=90, min_step=0.003):
+        """
+        :param window: float, seconds of history to keep
+        :param capacity: int, most samples kept, older ones are dropped early if frames come faster than this fills
+        :param min_step: float, movements shorter than this are jitter and don't count towards turning or reversals
+        """
+        self.window = window
+        self.capacity = capacity
+        self.min_step = min_step
+        # one slot per sample: (timestamp, x, y, step, turn, reversal, pinched)
+        self._samples = [None] * capacity
+        self.clear()
+
+    def clear(self):
+        self._oldest = 0
+        self.count = 0
+        self.path_length = 0.0
+        self.turning = 0.0
+        self.reversals = 0
+        self.pinched = 0
+        self._direction = None  # (dx, dy) of the last step longer than min_step
+        self._last_dx_sign = 0
+
+    def _newest(self):
+        return self._samples[(self._oldest + self.count - 1) % self.capacity]
+
+    def _drop_oldest(self):
+        self.pinched -= self._samples[self._oldest][6]
+        self._oldest = (self._oldest + 1) % self.capacity
+        self.count -= 1
+        if self.count:
+            # the new oldest sample's step came from the one just dropped, take it back out
+            timestamp, x, y, step, turn, reversal, pinched = self._samples[self._oldest]
+            self.path_length -= step
+            self.turning -= turn
+            self.reversals -= reversal
+            self._samples[self._oldest] = (timestamp, x, y, 0.0, 0.0, 0, pinched)
+        if self.count > 1:
+            # and the next sample's turn and reversal were measured against that step
+            second = (self._oldest + 1) % self.capacity
+            timestamp, x, y, step, turn, reversal, pinched = self._samples[second]
+            self.turning -= turn
+            self.reversals -= reversal
+            self._samples[second] = (timestamp, x, y, step, 0.0, 0, pinched)
+
+    def add(self, timestamp, x, y, pinched=False):
+        step = turn = 0.0
+        reversal = 0
+        if self.count:
+            _, last_x, last_y = self._newest()[:3]
+            dx, dy = x - last_x, y - last_y
+            step = math.hypot(dx, dy)
+            if step >= self.min_step:
+                if self._direction is not None:
+                    old_dx, old_dy = self._direction
+                    turn = math.atan2(old_dx * dy - old_dy * dx, old_dx * dx + old_dy * dy)
+                self._direction = (dx, dy)
+                sign = 1 if dx > self.min_step / 2 else -1 if dx < -self.min_step / 2 else 0
+                if sign and self._last_dx_sign and sign != self._last_dx_sign:
+                    reversal = 1
+                if sign:
+                    self._last_dx_sign = sign
+
+        if self.count == self.capacity:
+            self._drop_oldest()
+        self._samples[(self._oldest + self.count) % self.capacity] = (timestamp, x, y, step, turn, reversal,
+                                                                      int(pinched))
+        self.count += 1
+        self.path_length += step
+        self.turning += turn
+        self.reversals += reversal
+        self.pinched += int(pinched)
+
+        # each sample is dropped once, so this is O(1) per add on average
+        while self.count > 1 and timestamp - self._samples[self._oldest][0] > self.window:
+            self._drop_oldest()
+
+    def duration(self):
+        if not self.count:
+            return 0.0
+        return self._newest()[0] - self._samples[self._oldest][0]
+
+    def displacement(self):
+        if not self.count:
+            return 0.0, 0.0
+        oldest, newest = self._samples[self._oldest], self._newest()
+        return newest[1] - oldest[1], newest[2] - oldest[2]
+
+
+class DynamicGestureDetector:
+    """
+    Class DynamicGestureDetector:
+
+    Recognises gestures made over time rather than in one frame: swipes, circles, waves, and dragging while pinching.
+    Keeps a HandHistory per hand and checks its running features every frame, so detection costs the same however
+    long the window is. After an event a hand's history is cleared and nothing is collected for cooldown seconds, so
+    the rest of the same movement doesn't set off another one.
+
+    Distances are in normalised image units (the frame is 1 x 1), landmarks are the mirrored ones the tracker
+    publishes, so a swipe to the user's right is SwipeRight.
+
+    Methods
+    -------
+    update(hand, timestamp, landmarks):
+        Adds a hand's landmarks for a frame, returns the events it triggered
+    forget(hand):
+        Clears a hand's history, for when it goes out of view
+    """
+
+    def __init__(self, window=1.0, cooldown=0.5, min_samples=5, swipe_distance=0.25, swipe_straightness=0.8,
+                 swipe_turning=math.pi / 4, circle_turning=1.8 * math.pi, circle_path=0.3, wave_reversals=3,
+                 wave_path=0.3, pinch_ratio=0.35, drag_distance=0.1):
+        """
+        :param window: float, seconds of movement looked at
+        :param cooldown: float, seconds after an event before a hand can set off another one
+        :param min_samples: int, frames a hand has to be seen for before anything is detected
+        :param swipe_distance: float, distance a hand has to move in a straight line for a swipe
+        :param swipe_straightness: float, distance moved over length of the path, 1 is perfectly straight
+        :param swipe_turning: float, most radians the direction can turn through during a swipe
+        :param circle_turning: float, radians the direction has to turn through for a circle
+        :param circle_path: float, shortest path that counts as a circle
+        :param wave_reversals: int, left/right changes of direction for a wave
+        :param wave_path: float, shortest path that counts as a wave
+        :param pinch_ratio: float, thumb to index fingertip distance, in palm sizes, below which the hand is pinching
+        :param drag_distance: float, distance a hand has to move while pinching the whole window for a pinch drag
+        """
+        self.window = window
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self.swipe_distance = swipe_distance
+        self.swipe_straightness = swipe_straightness
+        self.swipe_turning = swipe_turning
+        self.circle_turning = circle_turning
+        self.circle_path = circle_path
+        self.wave_reversals = wave_reversals
+        self.wave_path = wave_path
+        self.pinch_ratio = pinch_ratio
+        self.drag_distance = drag_distance
+        self.histories = dict()  # hand label -> HandHistory
+        self._quiet_until = dict()  # hand label -> timestamp its cooldown ends
+
+    def update(self, hand, timestamp, landmarks):
+        """
+        :param hand: str, "Left" or "Right"
+        :param timestamp: float, time.monotonic() of the frame
+        :param landmarks: list of 21 Landmark
+        :return: list of event names from EVENTS, usually empty
+        """
+        if timestamp < self._quiet_until.get(hand, -math.inf):
+            return []
+        history = self.histories.get(hand)
+        if history is None:
+            history = self.histories[hand] = HandHistory(self.window)
+
+        wrist, middle = landmarks[0], landmarks[9]
+        palm = math.hypot(middle.x - wrist.x, middle.y - wrist.y) or 1.0
+        pinch = math.hypot(landmarks[4].x - landmarks[8].x, landmarks[4].y - landmarks[8].y) / palm
+        history.add(timestamp, (wrist.x + middle.x) / 2, (wrist.y + middle.y) / 2, pinch < self.pinch_ratio)
+
+        event = self._detect(history)
+        if event is None:
+            return []
+        history.clear()
+        self._quiet_until[hand] = timestamp + self.cooldown
+        return [event]
+
+    def _detect(self, history):
+        if history.count < self.min_samples:
+            return None
+        dx, dy = history.displacement()
+        distance = math.hypot(dx, dy)
+
+        if history.pinched == history.count:
+            return "PinchDrag" if distance >= self.drag_distance else None
+        if abs(history.turning) >= self.circle_turning and history.path_length >= self.circle_path:
+            return "CircleClockwise" if history.turning > 0 else "CircleCounterClockwise"
+        if history.reversals >= self.wave_reversals and history.path_length >= self.wave_path:
+            return "Wave"
+        if (distance >= self.swipe_distance and distance >= self.swipe_straightness * history.path_length
+                and abs(history.turning) <= self.swipe_turning):
+            if abs(dx) >= abs(dy):
+                return "SwipeRight" if dx > 0 else "SwipeLeft"
+            return "SwipeDown" if dy > 0 else "SwipeUp"
+        return None
+
+    def forget(self, hand):
+        history = self.histories.get(hand)
+        if history is not None:
+            history.clear()
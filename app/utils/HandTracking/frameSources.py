@@ -0,0 +1,176 @@
+import glob
+import itertools
+import os
+import time
+
+import numpy as np
+
+# cv2 is only imported by the sources that need it, so shared capture readers and synthetic sources don't load it
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+class FrameSource:
+    """
+    Class FrameSource:
+
+    Anything HandTrackingMain can pull frames from. Same interface as cv2.VideoCapture so the tracking loop doesn't
+    care whether it's reading a camera, a video file, a folder of images or frames generated in memory.
+
+    Methods
+    -------
+    isOpened():
+        True if the source can still produce frames
+    read():
+        Returns (rval, frame), rval is False once the source has run out
+    release():
+        Frees whatever the source is holding on to
+    """
+
+    live = False  # live sources can't be paused, so frames the tracker doesn't keep up with are dropped
+
+    def isOpened(self):
+        return False
+
+    def read(self):
+        return False, None
+
+    def release(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    live = True
+
+    def __init__(self, index=0):
+        """
+        :param index: int, camera index passed to cv2.VideoCapture
+        """
+        import cv2
+        self.index = index
+        self.vc = cv2.VideoCapture(index)
+
+    def isOpened(self):
+        return self.vc.isOpened()
+
+    def read(self):
+        return self.vc.read()
+
+    def release(self):
+        self.vc.release()
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, path, loop=False, realtime=False):
+        """
+        :param path: str, path to a video file
+        :param loop: bool, start again from the first frame when the video ends
+        :param realtime: bool, sleep between frames so the video plays at its own fps instead of as fast as possible
+        """
+        import cv2
+        self.path = path
+        self.loop = loop
+        self.vc = cv2.VideoCapture(path)
+        fps = self.vc.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1 / fps if realtime and fps > 0 else 0
+        self._next_frame_time = 0
+
+    def isOpened(self):
+        return self.vc.isOpened()
+
+    def read(self):
+        if self.frame_interval:
+            delay = self._next_frame_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame_time = max(self._next_frame_time, time.perf_counter()) + self.frame_interval
+
+        rval, frame = self.vc.read()
+        if not rval and self.loop:
+            import cv2
+            self.vc.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            rval, frame = self.vc.read()
+        return rval, frame
+
+    def release(self):
+        self.vc.release()
+
+
+class ImageDirectorySource(FrameSource):
+    def __init__(self, path, loop=False):
+        """
+        :param path: str, folder of images, read in filename order
+        :param loop: bool, start again from the first image after the last one
+        """
+        self.path = path
+        self.loop = loop
+        self.files = sorted(file for file in glob.glob(os.path.join(path, "*"))
+                            if file.lower().endswith(IMAGE_EXTENSIONS))
+        self.position = 0
+
+    def isOpened(self):
+        return self.position < len(self.files) or (self.loop and len(self.files) > 0)
+
+    def read(self):
+        import cv2
+        if self.loop and self.position >= len(self.files):
+            self.position = 0
+        while self.position < len(self.files):
+            frame = cv2.imread(self.files[self.position])
+            self.position += 1
+            if frame is not None:
+                return True, frame
+            print(f"couldn't read image {self.files[self.position - 1]}, skipping")
+        return False, None
+
+
+class SyntheticSource(FrameSource):
+    def __init__(self, frames=None, width=640, height=480, count=None):
+        """
+        :param frames: iterable of BGR numpy frames (e.g. a generator), if None blank frames are produced
+        :param width: int, width of the blank frames
+        :param height: int, height of the blank frames
+        :param count: int, stop after this many frames, None for no limit
+        """
+        if frames is None:
+            frames = itertools.repeat(np.zeros((height, width, 3), dtype=np.uint8))
+        self.frames = iter(frames)
+        self.count = count
+        self.produced = 0
+        self.finished = False
+
+    def isOpened(self):
+        return not self.finished
+
+    def read(self):
+        if self.count is not None and self.produced >= self.count:
+            self.finished = True
+        if self.finished:
+            return False, None
+
+        frame = next(self.frames, None)
+        if frame is None:
+            self.finished = True
+            return False, None
+        self.produced += 1
+        return True, frame
+
+    def release(self):
+        self.finished = True
+
+
+def open_frame_source(source=0, loop=False):
+    """
+    Picks a FrameSource for whatever's passed in
+
+    :param source: FrameSource, camera index, folder of images, or path to a video file
+    :param loop: bool, loop video files and image folders
+    :return: FrameSource
+    """
+    if isinstance(source, FrameSource):
+        return source
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        return CameraSource(int(source))
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, loop)
+    return VideoFileSource(source, loop)
@@ -0,0 +1,141 @@
+import json
+import os
+
+import numpy as np
+
+ORIENTATIONS = ("up", "down", "left", "right")
+FINGER_NAMES = ("thumb", "index", "middle", "ring", "pinky")
+
+DEFAULT_GESTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gestures.json")
+
+
+class GestureConflictError(ValueError):
+    pass
+
+
+def get_finger_mask(extended):
+    """
+    :param extended: 5 bools in FINGER_NAMES order, or a collection of extended finger names
+    :return: int, bit i set if finger i is extended (thumb is bit 0)
+    """
+    if all(isinstance(finger, str) for finger in extended):
+        unknown = set(extended) - set(FINGER_NAMES)
+        if unknown:
+            raise ValueError(f"unknown finger names: {sorted(unknown)}")
+        return sum(1 << i for i, finger in enumerate(FINGER_NAMES) if finger in extended)
+
+    extended = list(extended)
+    if len(extended) != 5:
+        raise ValueError(f"expected 5 finger flags, got {len(extended)}")
+    return sum(1 << i for i, is_extended in enumerate(extended) if is_extended)
+
+
+class GestureRegistry:
+    """
+    Class GestureRegistry:
+
+    Every gesture template compiled into a 32 x 4 table keyed on (finger mask, orientation), so looking up a hand
+    costs the same no matter how many gestures are registered. "any" orientation is expanded into all four
+    orientations when a template is registered.
+
+    Attributes
+    ----------
+    names : list[str], gesture id -> name, id 0 is "None"
+    table : numpy array (32, 4) of gesture ids
+    conflicts : list of (mask, orientation, existing name, new name) for templates that collided
+    strict : bool, raise GestureConflictError on a collision instead of letting the newer template win
+
+    Methods
+    -------
+    register(name, orientation, extended):
+        Adds one template
+    lookup(mask, orientation):
+        Gets the gesture name for a hand
+    lookup_ids(masks, orientations):
+        Vectorised lookup for arrays of masks and orientation codes
+    """
+
+    def __init__(self, strict=True):
+        self.strict = strict
+        self.names = ["None"]
+        self._ids = {"None": 0}
+        self.table = np.zeros((32, len(ORIENTATIONS)), dtype=np.uint16)
+        self.conflicts = []
+
+    def __len__(self):
+        return len(self.names) - 1
+
+    def get_id(self, name):
+        if name not in self._ids:
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+        return self._ids[name]
+
+    def register(self, name, orientation, extended):
+        """
+        :param name: str, name of the gesture
+        :param orientation: str, "up", "down", "left", "right" or "any"
+        :param extended: 5 bools in FINGER_NAMES order, or a collection of extended finger names
+        """
+        if orientation == "any":
+            orientations = range(len(ORIENTATIONS))
+        elif orientation in ORIENTATIONS:
+            orientations = [ORIENTATIONS.index(orientation)]
+        else:
+            raise ValueError(f"gesture {name!r} has unknown orientation {orientation!r}")
+
+        mask = get_finger_mask(extended)
+        gesture_id = self.get_id(name)
+        for o in orientations:
+            existing = self.table[mask, o]
+            if existing and existing != gesture_id:
+                conflict = (mask, ORIENTATIONS[o], self.names[existing], name)
+                if self.strict:
+                    raise GestureConflictError(f"gesture {name!r} collides with {self.names[existing]!r} "
+                                               f"for fingers {mask:05b} pointing {ORIENTATIONS[o]}")
+                self.conflicts.append(conflict)
+                print(f"gesture {name!r} overrides {self.names[existing]!r} for fingers {mask:05b} "
+                      f"pointing {ORIENTATIONS[o]}")
+            self.table[mask, o] = gesture_id
+
+    def lookup(self, mask, orientation):
+        """
+        :param mask: int finger mask, see get_finger_mask
+        :param orientation: str, one of ORIENTATIONS
+        :return: str, name of the gesture or "None"
+        """
+        if orientation not in ORIENTATIONS:
+            return "None"
+        return self.names[self.table[mask, ORIENTATIONS.index(orientation)]]
+
+    def lookup_ids(self, masks, orientations):
+        """
+        :param masks: int array (N,) of finger masks
+        :param orientations: int array (N,) of indices into ORIENTATIONS
+        :return: array (N,) of gesture ids, index into self.names
+        """
+        return self.table[masks, orientations]
+
+    @classmethod
+    def from_gestures(cls, gestures, strict=True):
+        """
+        :param gestures: list of Gesture templates with fingers[i].extended set, in priority order
+        """
+        registry = cls(strict)
+        for gesture in gestures:
+            registry.register(gesture.name, gesture.orientation, [finger.extended for finger in gesture.fingers])
+        return registry
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_GESTURES_PATH, strict=True):
+        """
+        Loads gestures from a json file like gestures.json:
+        {"gestures": [{"name": "ThumbsUp", "orientation": "left", "extended": ["thumb"]}, ...]}
+        """
+        with open(path) as file:
+            data = json.load(file)
+
+        registry = cls(strict)
+        for gesture in data["gestures"]:
+            registry.register(gesture["name"], gesture.get("orientation", "any"), gesture["extended"])
+        return registry
@@ -0,0 +1,119 @@
+from .. import metrics
+
+FRAME_RATE = metrics.registry.gauge("handtracking_governor_frame_rate", "Frame rate the governor is running at")
+
+
+def _decision_counter(reason):
+    return metrics.registry.counter("handtracking_governor_decisions_total",
+                                    "Frames the governor picked the rate for, by what decided it", reason=reason)
+
+
+class FrameRateGovernor:
+    """
+    Class FrameRateGovernor:
+
+    Picks how often the tracking loop processes a frame, instead of a fixed tracking_interval. Runs at max_rate while
+    hands are moving, present_rate while they're in view but still and idle_rate when there aren't any, and ramps up
+    straight away but backs off gradually. Whatever it wants is then limited by the cpu budget (fraction of a core
+    inference is allowed to use) and pushed up if needed to keep end to end latency under target_latency.
+
+    Attributes
+    ----------
+    rate : float, frames per second it's currently running at
+    interval : float, seconds between frames (1 / rate)
+    reason : str, what decided the current rate, e.g. "moving", "idle", "cpu budget"
+    average_inference : float, smoothed seconds per processed frame
+
+    Methods
+    -------
+    update(inference_time, hands_present, hands_moving):
+        Feeds in the last frame and works out the new rate
+    get_metrics():
+        The governor's current state and decisions, as a dict
+    """
+
+    def __init__(self, max_rate=30.0, present_rate=15.0, idle_rate=5.0, min_rate=1.0, target_latency=0.1,
+                 cpu_budget=0.8, smoothing=0.2, backoff=0.9):
+        """
+        :param max_rate: float, fps while hands are moving
+        :param present_rate: float, fps while hands are in view but not moving
+        :param idle_rate: float, fps with no hands in view
+        :param min_rate: float, never go slower than this
+        :param target_latency: float, seconds from a frame being captured to it being published to aim for
+        :param cpu_budget: float, fraction of one core inference may use, e.g. 0.5
+        :param smoothing: float, weight of the newest inference time in the running average
+        :param backoff: float, how much of the old rate is kept each frame when slowing down (0-1)
+        """
+        self.max_rate = max_rate
+        self.present_rate = present_rate
+        self.idle_rate = idle_rate
+        self.min_rate = min_rate
+        self.target_latency = target_latency
+        self.cpu_budget = cpu_budget
+        self.smoothing = smoothing
+        self.backoff = backoff
+
+        self.rate = idle_rate
+        self.reason = "starting"
+        self.average_inference = None
+        self.decisions = dict()  # reason -> number of frames it decided the rate
+        self._decision_counters = dict()  # reason -> metrics counter, looked up once per reason
+
+    @property
+    def interval(self):
+        return 1 / self.rate
+
+    def update(self, inference_time, hands_present, hands_moving):
+        """
+        :param inference_time: float, seconds the last frame took to process
+        :param hands_present: bool, the last frame had hands in it
+        :param hands_moving: bool, the hands are moving
+        :return: float, seconds to wait before the next frame
+        """
+        if self.average_inference is None:
+            self.average_inference = inference_time
+        else:
+            self.average_inference += self.smoothing * (inference_time - self.average_inference)
+
+        if hands_moving:
+            wanted, reason = self.max_rate, "moving"
+        elif hands_present:
+            wanted, reason = self.present_rate, "present"
+        else:
+            wanted, reason = self.idle_rate, "idle"
+
+        if hands_present:
+            # a frame waits half an interval on average before it's processed, then takes the inference time
+            headroom = self.target_latency - self.average_inference
+            latency_rate = 1 / (2 * headroom) if headroom > 0 else self.max_rate
+            if latency_rate > wanted:
+                wanted, reason = min(latency_rate, self.max_rate), "latency target"
+
+        if self.average_inference > 0:
+            budget_rate = self.cpu_budget / self.average_inference
+            if budget_rate < wanted:
+                wanted, reason = budget_rate, "cpu budget"
+
+        wanted = max(wanted, self.min_rate)
+        if wanted >= self.rate:
+            self.rate = wanted  # speed up straight away so fast movements aren't missed
+        else:
+            self.rate = max(wanted, self.rate * self.backoff)
+            if self.rate > wanted:
+                reason = "backing off"
+
+        self.reason = reason
+        self.decisions[reason] = self.decisions.get(reason, 0) + 1
+        if reason not in self._decision_counters:
+            self._decision_counters[reason] = _decision_counter(reason)
+        self._decision_counters[reason].inc()
+        FRAME_RATE.set(self.rate)
+        return self.interval
+
+    def get_metrics(self):
+        return {
+            "rate": round(self.rate, 2),
+            "reason": self.reason,
+            "average_inference_ms": round((self.average_inference or 0) * 1000, 2),
+            "decisions": dict(self.decisions)
+        }
@@ -1,12 +1,33 @@
 import asyncio
-import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
 import mediapipe as mp
 import math
 
+from .frameSources import open_frame_source
+from .pipeline import CapturedFrame, FrameGrabber, PipelineStats
+from .recording import LandmarkRecorder
+from .motionGate import LandmarkExtrapolator, MotionGate
+from .governor import FrameRateGovernor
+from .preprocess import MIRRORED_HANDEDNESS, FramePreprocessor, OverlayRenderer
+from .batchClassify import classify_batch, landmarks_to_array
+from .gestureRegistry import DEFAULT_GESTURES_PATH, GestureRegistry, get_finger_mask
+from .poseClassifier import PoseClassifier
+from .dynamicGestures import DynamicGestureDetector
+from .. import metrics
+
+INFERENCE_TIME = metrics.registry.histogram("handtracking_inference_seconds", "Time mediapipe takes on a frame")
+CLASSIFICATION_TIME = metrics.registry.histogram("handtracking_classification_seconds",
+                                                 "Time to work out one hand's gesture from its landmarks")
+CAPTURE_TO_PUBLISH = metrics.registry.histogram("handtracking_latency_seconds",
+                                                "Time from a frame being captured to it reaching each hop",
+                                                hop="capture_to_publish")
+FRAMES_PREDICTED = metrics.registry.counter("handtracking_frames_predicted_total",
+                                            "Frames the motion gate skipped inference on")
+
 
 def get_angle_3_points(point_a, point_b, point_c):
     """
@@ -75,6 +96,8 @@ class Gesture:
         Constructor
     compare(other):
         Compares two gestures to each other
+    get_finger_mask():
+        Gets the extended fingers as a bitmask for GestureRegistry lookups
     get_orientation():
         Gets the orientation of the gesture if self.orientation is set to "unknown"
     """
@@ -111,6 +134,13 @@ class Gesture:
         else:
             return False
 
+    def get_finger_mask(self):
+        """
+
+        :return: int, bit i set if self.fingers[i] is extended (thumb is bit 0), see GestureRegistry
+        """
+        return get_finger_mask([finger.extended for finger in self.fingers])
+
     def get_orientation(self):
         """
 
@@ -137,17 +167,59 @@ class Gesture:
 
 
 class HandTrackingMain:
-    def __init__(self):
+    def __init__(self, frame_source=0, headless=False, gestures_path=DEFAULT_GESTURES_PATH, record_path=None,
+                 motion_gate=None, source_id=None, roi=False, poses=None, dynamic_gestures=None, warm_up=True,
+                 startup=None):
+        """
+        :param frame_source: FrameSource, camera index, video file or folder of images, see open_frame_source
+        :param headless: bool, never open a preview window or wait for key presses (for servers and CI)
+        :param gestures_path: str, json file of gesture templates
+        :param record_path: str, if set every published frame is also recorded to this file, see LandmarkRecorder
+        :param motion_gate: MotionGate, skips inference on frames where nothing moved, None runs it on every frame
+        :param source_id: str, if set every frame is tagged with it as "Source", for running several cameras at once
+        :param roi: bool, only run mediapipe on the part of the frame around the hands, see FramePreprocessor
+        :param poses: PoseClassifier or the path of a pose library, poses it recognises take priority over the
+                      gesture templates
+        :param dynamic_gestures: DynamicGestureDetector, adds swipes, circles etc. to the output as "Events", None
+                                 to leave them out
+        :param warm_up: bool, run the model once on a blank frame before opening the frame source, see warm_up
+        :param startup: metrics.StartupTimer to time each step of starting up in, a new one if None
+        """
+        if startup is None:
+            startup = metrics.StartupTimer("tracker" if source_id is None else f"tracker {source_id}")
+        self.startup = startup
+
         # Initialise mediapipe's hand tracking solution
         self.mp_drawing = mp.solutions.drawing_utils  # so we can draw the hand landmarks onto the frame
         self.mp_drawing_styles = mp.solutions.drawing_styles
         self.mp_hands = mp.solutions.hands
         self.hands = self.mp_hands.Hands(model_complexity=0, min_detection_confidence=0.5, min_tracking_confidence=0.5)
-
-        # Create a window for the camera feed called "preview"
-        cv2.namedWindow("preview")
-        # Start capturing from the default camera
-        self.vc = cv2.VideoCapture(0)
+        # with roi, the full frames that look for new hands in between crops go through an instance that treats every
+        # image on its own, so they don't throw off the tracking on the crop, see pick_hands
+        self.redetect_hands = None if not roi else self.mp_hands.Hands(
+            static_image_mode=True, model_complexity=0, min_detection_confidence=0.5)
+        self._tracking_window = None  # part of the frame self.hands was last run on
+        self.startup.mark("mediapipe")
+
+        # gesture templates compiled into a lookup table, see gestures.json for the format
+        self.gesture_registry = GestureRegistry.from_file(gestures_path)
+        self.pose_classifier = PoseClassifier.from_file(poses) if isinstance(poses, str) else poses
+        if self.pose_classifier is not None:
+            for name in self.pose_classifier.names:
+                self.gesture_registry.get_id(name)  # so recordings can store pose names too
+        self.startup.mark("gestures")
+
+        if warm_up:
+            # before the frame source is opened, so a camera isn't streaming frames nobody is reading yet
+            self.warm_up()
+
+        self.headless = headless
+        self.source_id = source_id
+        if not self.headless:
+            # Create a window for the camera feed called "preview"
+            cv2.namedWindow("preview")
+        # Start capturing from the chosen source, the default camera unless told otherwise
+        self.vc = open_frame_source(frame_source)
 
         self.font = cv2.FONT_HERSHEY_SIMPLEX
         if self.vc.isOpened():  # try to get the first frame
@@ -155,6 +227,7 @@ class HandTrackingMain:
             self.np_frame = np.asarray(self.frame)
         else:
             self.rval = False
+        self.startup.mark("frame source")
 
         self.gesture = Gesture("None", "None", [Finger(None, None, None, None, True, "thumb", False),
                                                 Finger(None, None, None, None, False, "index", False),
@@ -172,92 +245,82 @@ class HandTrackingMain:
         self.left_landmarks = None
         self.right_landmarks = None
 
-        self.gestures = [Gesture("ThumbsUp", "left", [
-            Finger(None, None, None, None, True, "thumb", True),
-            Finger(None, None, None, None, False, "index", False),
-            Finger(None, None, None, None, False, "middle", False),
-            Finger(None, None, None, None, False, "ring", False),
-            Finger(None, None, None, None, False, "pinky", False)]),
-                         Gesture("ThumbsUp", "right", [
-                             Finger(None, None, None, None, True, "thumb", True),
-                             Finger(None, None, None, None, False, "index", False),
-                             Finger(None, None, None, None, False, "middle", False),
-                             Finger(None, None, None, None, False, "ring", False),
-                             Finger(None, None, None, None, False, "pinky", False)]),
-                         Gesture("MiddleFinger", "up", [
-                             Finger(None, None, None, None, True, "thumb", False),
-                             Finger(None, None, None, None, False, "index", False),
-                             Finger(None, None, None, None, False, "middle", True),
-                             Finger(None, None, None, None, False, "ring", False),
-                             Finger(None, None, None, None, False, "pinky", False)]),
-                         Gesture("Fist", "any", [
-                             Finger(None, None, None, None, True, "thumb", False),
-                             Finger(None, None, None, None, False, "index", False),
-                             Finger(None, None, None, None, False, "middle", False),
-                             Finger(None, None, None, None, False, "ring", False),
-                             Finger(None, None, None, None, False, "pinky", False)]),
-                         Gesture("OpenPalm", "any", [
-                             Finger(None, None, None, None, True, "thumb", True),
-                             Finger(None, None, None, None, False, "index", True),
-                             Finger(None, None, None, None, False, "middle", True),
-                             Finger(None, None, None, None, False, "ring", True),
-                             Finger(None, None, None, None, False, "pinky", True)]),
-                         Gesture("Metal", "up", [
-                             Finger(None, None, None, None, True, "thumb", False),
-                             Finger(None, None, None, None, False, "index", True),
-                             Finger(None, None, None, None, False, "middle", False),
-                             Finger(None, None, None, None, False, "ring", False),
-                             Finger(None, None, None, None, False, "pinky", True)]),
-                         Gesture("WebShooter", "down", [
-                             Finger(None, None, None, None, True, "thumb", False),
-                             Finger(None, None, None, None, False, "index", True),
-                             Finger(None, None, None, None, False, "middle", False),
-                             Finger(None, None, None, None, False, "ring", False),
-                             Finger(None, None, None, None, False, "pinky", True)]),
-                         Gesture("Number1", "up", [
-                             Finger(None, None, None, None, True, "thumb", False),
-                             Finger(None, None, None, None, False, "index", True),
-                             Finger(None, None, None, None, False, "middle", False),
-                             Finger(None, None, None, None, False, "ring", False),
-                             Finger(None, None, None, None, False, "pinky", False)]),
-                         Gesture("Number2", "up", [
-                             Finger(None, None, None, None, True, "thumb", False),
-                             Finger(None, None, None, None, False, "index", True),
-                             Finger(None, None, None, None, False, "middle", True),
-                             Finger(None, None, None, None, False, "ring", False),
-                             Finger(None, None, None, None, False, "pinky", False)]),
-                         Gesture("Number3", "up", [
-                             Finger(None, None, None, None, True, "thumb", False),
-                             Finger(None, None, None, None, False, "index", True),
-                             Finger(None, None, None, None, False, "middle", True),
-                             Finger(None, None, None, None, False, "ring", True),
-                             Finger(None, None, None, None, False, "pinky", False)]),
-                         Gesture("Ok", "up", [
-                             Finger(None, None, None, None, True, "thumb", True),
-                             Finger(None, None, None, None, False, "index", False),
-                             Finger(None, None, None, None, False, "middle", True),
-                             Finger(None, None, None, None, False, "ring", True),
-                             Finger(None, None, None, None, False, "pinky", True)])
-                         ]
+        self.recorder = LandmarkRecorder(record_path, self.gesture_registry.names) if record_path else None
+
+        self.motion_gate = motion_gate
+        self.extrapolator = LandmarkExtrapolator()
+        self.dynamic_gestures = dynamic_gestures
+
+        self.preprocessor = FramePreprocessor(roi)
+        # the preview is drawn on its own thread, and not at all when headless
+        self.overlay = None if headless else OverlayRenderer(self.mp_hands, self.mp_drawing,
+                                                             self.mp_drawing_styles, self.font)
+
+    def warm_up(self, width=640, height=480):
+        """
+        Runs mediapipe once on a blank frame, so loading the model and everything else the first frame would pay
+        for happens now rather than on the first real frame
+
+        :param width: int, width of the blank frame
+        :param height: int, height of the blank frame
+        """
+        self.hands.process(np.zeros((height, width, 3), np.uint8))
+        if self.redetect_hands is not None:
+            self.redetect_hands.process(np.zeros((height, width, 3), np.uint8))
+        if self.pose_classifier is not None:
+            self.pose_classifier.classify(np.zeros((21, 3)))  # builds its tree
+        self.startup.mark("warm up")
+
+    def pick_hands(self):
+        """
+        Mediapipe instance to run on the image the preprocessor just prepared. self.hands tracks the hands from
+        one image to the next, which only works while every image covers the same part of the frame, so it's reset
+        whenever the crop window moves. Full frame re-detections in between crops go to redetect_hands instead, and
+        the tracking carries on on the next crop.
+        """
+        if self.preprocessor.redetecting:
+            return self.redetect_hands
+        if self.preprocessor.window != self._tracking_window:
+            if self._tracking_window is not None:
+                self.hands.reset()  # its last landmarks are from a different window
+            self._tracking_window = self.preprocessor.window
+        return self.hands
 
     def detect_gestures(self, landmarks):
         hand = self.assemble_hand(landmarks)
         hand.orientation = hand.get_orientation()
         # print(hand.orientation)
-
-        for gesture in self.gestures:
-            if hand.compare(gesture):
-                hand.name = gesture.name
+        hand.name = self.gesture_registry.lookup(hand.get_finger_mask(), hand.orientation)
+        if self.pose_classifier is not None:
+            pose = self.pose_classifier.classify(landmarks)
+            if pose is not None:
+                hand.name = pose
 
         return hand
 
+    def classify_batch(self, hands):
+        """
+        Same as detect_gestures but for a whole (N, 21, 3) array of hands at once, see batchClassify
+
+        :param hands: array (N, 21, 3) of landmarks, or a list of mediapipe landmark lists
+        :return: BatchClassification(extended, orientation, gesture)
+        """
+        if not isinstance(hands, np.ndarray):
+            hands = landmarks_to_array(hands)
+        result = classify_batch(hands, self.gesture_registry)
+        if self.pose_classifier is not None:
+            for i, pose in enumerate(self.pose_classifier.classify_many(hands)):
+                if pose is not None:
+                    result.gesture[i] = pose
+        return result
+
     def assemble_hand(self, landmarks):
         wrist = landmarks[0]
-        f_thumb = Finger(landmarks[1], landmarks[2], landmarks[3], landmarks[4], wrist, True)
-        f_index = Finger(landmarks[5], landmarks[6], landmarks[7], landmarks[8], wrist)
-        f_middle = Finger(landmarks[9], landmarks[10], landmarks[11], landmarks[12], wrist)
-        f_ring = Finger(landmarks[13], landmarks[14], landmarks[15], landmarks[16], wrist)
-        f_pinky = Finger(landmarks[17], landmarks[18], landmarks[19], landmarks[20], wrist)
+        f_thumb = Finger(landmarks[1], landmarks[2], landmarks[3], landmarks[4], True, "thumb")
+        f_index = Finger(landmarks[5], landmarks[6], landmarks[7], landmarks[8], False, "index")
+        f_middle = Finger(landmarks[9], landmarks[10], landmarks[11], landmarks[12], False, "middle")
+        f_ring = Finger(landmarks[13], landmarks[14], landmarks[15], landmarks[16], False, "ring")
+        f_pinky = Finger(landmarks[17], landmarks[18], landmarks[19], landmarks[20], False, "pinky")
 
         hand = Gesture("None", "None", [f_thumb, f_index, f_middle, f_ring, f_pinky],
                        wrist)  # The current gesture that we want to check against the list of gestures
@@ -275,107 +338,247 @@ class HandTrackingMain:
         }
         return tracked_data
 
-    async def mainloop(self, websocket_client, tracking_interval=0.1):
-        last_processed_time = time.time()  # Track the last processed frame time
-
-        with self.hands:
-            while self.rval:
-                current_time = time.time()
-                if current_time - last_processed_time >= tracking_interval:
-                    last_processed_time = current_time  # Update the time of the last processed frame
-
-                    image_flipped = cv2.flip(self.frame, 1)
-                    image_flipped.flags.writeable = False
-                    image_flipped = cv2.cvtColor(image_flipped, cv2.COLOR_BGR2RGB)
-                    results = self.hands.process(image_flipped)
-
-                    self.left_orientation = None
-                    self.right_orientation = None
-                    self.left_landmarks = None
-                    self.right_landmarks = None
-
-                    image_flipped.flags.writeable = True
-                    image_flipped = cv2.cvtColor(image_flipped, cv2.COLOR_RGB2BGR)
-                    if results.multi_hand_landmarks and results.multi_handedness:
-                        for hand_landmarks, handedness in zip(results.multi_hand_landmarks, results.multi_handedness):
-                            self.mp_drawing.draw_landmarks(
-                                image_flipped,
-                                hand_landmarks,
-                                self.mp_hands.HAND_CONNECTIONS,
-                                self.mp_drawing_styles.get_default_hand_landmarks_style(),
-                                self.mp_drawing_styles.get_default_hand_connections_style()
-                            )
-                            landmarks = hand_landmarks.landmark
-                            self.gesture = self.detect_gestures(landmarks)
-                            match handedness.classification[0].label:
-                                case "Left":
-                                    self.left_landmarks = landmarks  # Set left hand landmarks
-                                    self.left_gesture = self.gesture
-                                    self.left_orientation = self.gesture.orientation if self.gesture.orientation is not None else "None"
-                                    image_flipped = cv2.putText(image_flipped, self.left_gesture.name, (50, 50),
-                                                                self.font,
-                                                                1, (255, 0, 255),
-                                                                2, cv2.LINE_AA)
-                                case "Right":
-                                    self.right_landmarks = landmarks  # Set left hand landmarks
-                                    self.right_gesture = self.gesture
-                                    self.right_orientation = self.gesture.orientation if self.gesture.orientation is not None else "None"
-
-                                    image_flipped = cv2.putText(image_flipped, self.right_gesture.name, (400, 50),
-                                                                self.font, 1,
-                                                                (255, 0, 255),
-                                                                2, cv2.LINE_AA)
-
-                        # at this point we have all the correct data to send across the api
-                        # it will be added into an array and sent so that it can be handled
-
-                        self.left_orientation = "None" if self.left_orientation is None else self.left_orientation
-                        self.right_orientation = "None" if self.right_orientation is None else self.right_orientation
-
-                        self.left_landmarks = "None" if self.left_landmarks is None else self.left_landmarks
-                        self.right_landmarks = "None" if self.right_landmarks is None else self.right_landmarks
-
-                        if self.left_landmarks is not None and self.left_landmarks != "None":
-                            reformatted_left_landmarks = self.get_formatted_hand_data(self.left_landmarks)
-                        else:
-                            reformatted_left_landmarks = "None"
-
-                        if self.right_landmarks is not None and self.right_landmarks != "None":
-                            reformatted_right_landmarks = self.get_formatted_hand_data(self.right_landmarks)
-                        else:
-                            reformatted_right_landmarks = "None"
-
-                        output = {
-                            "Left": {
-                                "Landmarks": reformatted_left_landmarks,
-                                "Gesture": self.left_gesture.name,
-                                "Orientation": self.left_orientation
-                            },
-                            "Right": {
-                                "Landmarks": reformatted_right_landmarks,
-                                "Gesture": self.right_gesture.name,
-                                "Orientation": self.right_orientation
-                            }
-                        }
-
-                        websocket_client.send_message(json.dumps(output))
-                        # print(output)
-
-                    cv2.imshow("preview", image_flipped)
-
-                self.rval, self.frame = self.vc.read()
-                key = cv2.waitKey(20)
-                if key == 27:  # exit on ESC
-                    break
-
-        cv2.destroyWindow("preview")
-        self.vc.release()
+    def process_frame(self, frame):
+        """
+        Inference stage: runs mediapipe and gesture detection on one frame. Runs on the inference executor, never
+        on the event loop. The frame isn't flipped or drawn on, see FramePreprocessor and OverlayRenderer
+
+        :param frame: BGR frame from the frame source
+        :return: (output, overlay) - output is the frame dict to publish or None if no hands were found, overlay is
+                 what the preview should draw, a list of (hand, landmarks, gesture name), or None when headless
+        """
+        timestamp = time.monotonic()
+        if self.motion_gate is not None and not self.motion_gate.should_infer(frame, self.extrapolator.is_moving()):
+            FRAMES_PREDICTED.inc()
+            overlay = None if self.headless else self.get_overlay(self.extrapolator.predict("Left", timestamp),
+                                                                  self.extrapolator.predict("Right", timestamp))
+            return self.predict_output(timestamp), overlay
+
+        image = self.preprocessor.prepare(frame)
+        hands = self.pick_hands()
+        with INFERENCE_TIME.time():
+            results = hands.process(image)
+        output = None
+
+        self.left_orientation = None
+        self.right_orientation = None
+        self.left_landmarks = None
+        self.right_landmarks = None
+
+        if results.multi_hand_landmarks and results.multi_handedness:
+            for hand_landmarks, handedness in zip(results.multi_hand_landmarks, results.multi_handedness):
+                # mirrored so they're the same as they'd be on a flipped frame, without flipping the frame
+                landmarks = self.preprocessor.to_frame_landmarks(hand_landmarks.landmark)
+                with CLASSIFICATION_TIME.time():
+                    self.gesture = self.detect_gestures(landmarks)
+                match MIRRORED_HANDEDNESS[handedness.classification[0].label]:
+                    case "Left":
+                        self.left_landmarks = landmarks  # Set left hand landmarks
+                        self.left_gesture = self.gesture
+                        self.left_orientation = self.gesture.orientation if self.gesture.orientation is not None else "None"
+                    case "Right":
+                        self.right_landmarks = landmarks  # Set left hand landmarks
+                        self.right_gesture = self.gesture
+                        self.right_orientation = self.gesture.orientation if self.gesture.orientation is not None else "None"
+            self.preprocessor.update([lm for lm in (self.left_landmarks, self.right_landmarks) if lm is not None])
+
+            # at this point we have all the correct data to send across the api
+            # it will be added into an array and sent so that it can be handled
+
+            events = {}
+            for hand, hand_landmarks in (("Left", self.left_landmarks), ("Right", self.right_landmarks)):
+                if hand_landmarks is None:
+                    self.extrapolator.forget(hand)
+                    if self.dynamic_gestures is not None:
+                        self.dynamic_gestures.forget(hand)
+                else:
+                    self.extrapolator.update(hand, timestamp, hand_landmarks)
+                    if self.dynamic_gestures is not None:
+                        events[hand] = self.dynamic_gestures.update(hand, timestamp, hand_landmarks)
+            overlay = self.get_overlay(self.left_landmarks, self.right_landmarks)
+
+            self.left_orientation = "None" if self.left_orientation is None else self.left_orientation
+            self.right_orientation = "None" if self.right_orientation is None else self.right_orientation
+
+            self.left_landmarks = "None" if self.left_landmarks is None else self.left_landmarks
+            self.right_landmarks = "None" if self.right_landmarks is None else self.right_landmarks
+
+            if self.left_landmarks is not None and self.left_landmarks != "None":
+                reformatted_left_landmarks = self.get_formatted_hand_data(self.left_landmarks)
+            else:
+                reformatted_left_landmarks = "None"
+
+            if self.right_landmarks is not None and self.right_landmarks != "None":
+                reformatted_right_landmarks = self.get_formatted_hand_data(self.right_landmarks)
+            else:
+                reformatted_right_landmarks = "None"
+
+            output = {
+                "Left": {
+                    "Landmarks": reformatted_left_landmarks,
+                    "Gesture": self.left_gesture.name,
+                    "Orientation": self.left_orientation
+                },
+                "Right": {
+                    "Landmarks": reformatted_right_landmarks,
+                    "Gesture": self.right_gesture.name,
+                    "Orientation": self.right_orientation
+                }
+            }
+            for hand, hand_events in events.items():
+                if hand_events:
+                    output[hand]["Events"] = hand_events  # only on the frame the gesture finished on
+
+            if self.recorder is not None:
+                self.recorder.record(time.time(),
+                                     (None if self.left_landmarks == "None" else self.left_landmarks,
+                                      self.left_gesture.name, self.left_orientation),
+                                     (None if self.right_landmarks == "None" else self.right_landmarks,
+                                      self.right_gesture.name, self.right_orientation))
+            # print(output)
+        else:
+            self.extrapolator.forget("Left")
+            self.extrapolator.forget("Right")
+            if self.dynamic_gestures is not None:
+                self.dynamic_gestures.forget("Left")
+                self.dynamic_gestures.forget("Right")
+            self.preprocessor.update([])
+            overlay = self.get_overlay()
 
+        return output, overlay
 
-async def main(websocket_client):
-    # this like initialises the camera and stuff. U can change the camera index it uses in here
-    handTrackManager = HandTrackingMain()
+    def get_overlay(self, left_landmarks=None, right_landmarks=None):
+        """
+        :return: list of (hand, landmarks, gesture name) for OverlayRenderer, or None when headless
+        """
+        if self.headless:
+            return None
+        return [("Left", left_landmarks, self.left_gesture.name if left_landmarks is not None else "None"),
+                ("Right", right_landmarks, self.right_gesture.name if right_landmarks is not None else "None")]
+
+    def predict_output(self, timestamp):
+        """
+        Builds the output for a frame the motion gate skipped, from the hands' last landmarks carried on at their
+        current velocity. Gestures and orientations are the last ones detected
 
-    # this does the actual tracking and the tracking interval is the delay between tracking frames. I think 0.01 is min
-    tracking_interval = 0.1
-    await handTrackManager.mainloop(websocket_client, tracking_interval)
+        :param timestamp: float, time.monotonic() of the frame
+        :return: dict output flagged with "Predicted", or None if there were no hands last time
+        """
+        left_landmarks = self.extrapolator.predict("Left", timestamp)
+        right_landmarks = self.extrapolator.predict("Right", timestamp)
+        if left_landmarks is None and right_landmarks is None:
+            return None
+
+        return {
+            "Left": {
+                "Landmarks": self.get_formatted_hand_data(left_landmarks) if left_landmarks is not None else "None",
+                "Gesture": self.left_gesture.name,
+                "Orientation": self.left_orientation if left_landmarks is not None else "None"
+            },
+            "Right": {
+                "Landmarks": self.get_formatted_hand_data(right_landmarks) if right_landmarks is not None else "None",
+                "Gesture": self.right_gesture.name,
+                "Orientation": self.right_orientation if right_landmarks is not None else "None"
+            },
+            "Predicted": True
+        }
+
+    async def mainloop(self, websocket_client, tracking_interval=0.1, governor=None):
+        """
+        Capture, inference and publish run as separate stages: a FrameGrabber thread keeps the newest frame in a
+        LatestFrameSlot, inference runs on a single worker executor (mediapipe isn't thread safe), and publishing
+        and the preview happen back on the event loop, which stays free while the other two stages work.
+
+        With a FrameRateGovernor the delay between frames is picked every frame from how long inference is taking
+        and whether hands are in view and moving, otherwise it's the fixed tracking_interval.
+        """
+        loop = asyncio.get_running_loop()
+        # live cameras drop frames inference can't keep up with, files and synthetic sources wait so none are lost
+        grabber = FrameGrabber(self.vc, drop_frames=getattr(self.vc, "live", False))
+        if self.rval:
+            grabber.captured += 1
+            # don't waste the frame __init__ already read
+            grabber.slot.put(CapturedFrame(self.frame, grabber.captured, time.time()))
+        self.stats = PipelineStats(governor)
+
+        with self.hands, ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference") as executor:
+            grabber.start()
+            if self.overlay is not None:
+                self.overlay.start()
+            try:
+                while True:
+                    started = time.perf_counter()
+                    captured = await loop.run_in_executor(executor, grabber.slot.take)
+                    if captured is None:  # the frame source has run out
+                        break
+                    frame = captured.image
+
+                    inference_started = time.perf_counter()
+                    output, overlay = await loop.run_in_executor(executor, self.process_frame, frame)
+                    inference_time = time.perf_counter() - inference_started
+                    self.stats.inference_time += inference_time
+                    self.stats.processed += 1
+
+                    if governor is not None:
+                        tracking_interval = governor.update(inference_time, output is not None,
+                                                            self.extrapolator.is_moving())
+
+                    if output is not None:
+                        if self.source_id is not None:
+                            output["Source"] = self.source_id
+                        # so the server and clients can tell how old the frame is and whether any went missing
+                        output["Sequence"] = captured.sequence
+                        output["Captured"] = captured.timestamp
+                        CAPTURE_TO_PUBLISH.observe(time.time() - captured.timestamp)
+                        # serialised on the websocket thread, in whichever wire format it's using
+                        websocket_client.send_message(output)
+                        self.stats.published += 1
+
+                    if self.overlay is not None:
+                        self.overlay.submit(frame, overlay)
+                        if self.overlay.latest is not None:
+                            cv2.imshow("preview", self.overlay.latest)
+                        # 1ms is just enough for the window to handle its events, anything longer caps the frame rate
+                        if cv2.waitKey(1) == 27:  # exit on ESC
+                            break
+
+                    # sleep off the rest of the interval instead of spinning on time.time()
+                    await asyncio.sleep(max(0.0, tracking_interval - (time.perf_counter() - started)))
+            finally:
+                grabber.stop()
+                if self.overlay is not None:
+                    self.overlay.stop()
+                if self.redetect_hands is not None:
+                    self.redetect_hands.close()
+                print(self.stats.summary(grabber))
+
+        if not self.headless:
+            cv2.destroyWindow("preview")
+        self.vc.release()
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f"recorded {self.recorder.frames} frames to {self.recorder.path}")
+
+
+async def main(websocket_client, frame_source=0, headless=False, record_path=None, motion_gate=False, governor=True,
+               tracking_interval=0.1, source_id=None, roi=False, poses=None, dynamic_gestures=False, startup=None):
+    # this like initialises the camera and stuff. frame_source can be a camera index, video file, folder of images
+    # or any FrameSource, and headless skips the preview window entirely
+    # motion_gate skips inference on frames where nothing moved, pass True for the defaults or your own MotionGate
+    if motion_gate is True:
+        motion_gate = MotionGate()
+    # dynamic_gestures adds swipes, circles, waves and pinch drags as "Events", True for the defaults or your own
+    # DynamicGestureDetector
+    if dynamic_gestures is True:
+        dynamic_gestures = DynamicGestureDetector()
+    # startup is a metrics.StartupTimer, pass one started before importing this module to have the imports counted
+    handTrackManager = HandTrackingMain(frame_source, headless, record_path=record_path,
+                                        motion_gate=motion_gate or None, source_id=source_id, roi=roi,
+                                        poses=poses, dynamic_gestures=dynamic_gestures or None, startup=startup)
+    handTrackManager.startup.report()
+
+    # this does the actual tracking. the governor picks the delay between tracking frames as it goes, pass True for
+    # the defaults, your own FrameRateGovernor, or False to use the fixed tracking_interval instead
+    if governor is True:
+        governor = FrameRateGovernor()
+    await handTrackManager.mainloop(websocket_client, tracking_interval, governor or None)
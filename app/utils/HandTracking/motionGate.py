@@ -0,0 +1,119 @@
+import collections
+
+import cv2
+import numpy as np
+
+Landmark = collections.namedtuple("Landmark", ["x", "y", "z"])  # looks enough like a mediapipe landmark
+
+
+class MotionGate:
+    """
+    Class MotionGate:
+
+    Cheap check in front of mediapipe. Each frame is shrunk to a small greyscale thumbnail and compared with the
+    thumbnail of the last frame inference ran on; if hardly anything changed inference is skipped. While hands are
+    moving inference can also be limited to every predict_stride frames, with LandmarkExtrapolator filling the gaps.
+
+    Attributes
+    ----------
+    threshold : float, mean absolute grey level difference (0-255) below which the scene counts as unchanged
+    max_skipped : int, inference always runs after this many skipped frames in a row
+    predict_stride : int, while hands are moving only run inference every this many frames (1 = every frame)
+    inferred : int, frames the gate let through
+    skipped : int, frames the gate skipped
+    """
+
+    def __init__(self, threshold=2.0, max_skipped=15, predict_stride=1, thumbnail_size=(64, 48)):
+        self.threshold = threshold
+        self.max_skipped = max_skipped
+        self.predict_stride = max(1, predict_stride)
+        self.thumbnail_size = thumbnail_size
+        self._reference = None
+        self._skipped_in_a_row = 0
+        self.inferred = 0
+        self.skipped = 0
+
+    def get_thumbnail(self, frame):
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def should_infer(self, frame, hands_moving=False):
+        """
+        :param frame: BGR frame
+        :param hands_moving: bool, from LandmarkExtrapolator.is_moving
+        :return: True if inference should run on this frame
+        """
+        thumbnail = self.get_thumbnail(frame)
+        infer = (self._reference is None
+                 or self._skipped_in_a_row >= self.max_skipped
+                 or (hands_moving and self._skipped_in_a_row + 1 >= self.predict_stride))
+        if not infer and not hands_moving:
+            infer = float(np.mean(cv2.absdiff(thumbnail, self._reference))) >= self.threshold
+
+        if infer:
+            self._reference = thumbnail
+            self._skipped_in_a_row = 0
+            self.inferred += 1
+        else:
+            self._skipped_in_a_row += 1
+            self.skipped += 1
+        return infer
+
+
+class LandmarkExtrapolator:
+    """
+    Class LandmarkExtrapolator:
+
+    Remembers the last two inferred positions of each hand and predicts where the landmarks are for frames inference
+    was skipped on, by carrying on at the same velocity
+
+    Attributes
+    ----------
+    max_horizon : float, seconds past the last real landmarks a prediction is allowed to reach
+    moving_speed : float, wrist speed (normalised image units per second) above which a hand counts as moving
+    """
+
+    def __init__(self, max_horizon=0.2, moving_speed=0.05):
+        self.max_horizon = max_horizon
+        self.moving_speed = moving_speed
+        self.history = dict()  # hand label -> deque of (timestamp, (21, 3) array)
+
+    def update(self, hand, timestamp, landmarks):
+        """
+        :param hand: str, "Left" or "Right"
+        :param timestamp: float, time.monotonic() of the frame
+        :param landmarks: mediapipe landmarks or a (21, 3) array
+        """
+        if not isinstance(landmarks, np.ndarray):
+            landmarks = np.array([(lm.x, lm.y, lm.z) for lm in landmarks], dtype=np.float64)
+        self.history.setdefault(hand, collections.deque(maxlen=2)).append((timestamp, landmarks))
+
+    def forget(self, hand):
+        self.history.pop(hand, None)
+
+    def get_velocity(self, hand):
+        history = self.history.get(hand)
+        if history is None or len(history) < 2:
+            return None
+        (t0, a0), (t1, a1) = history
+        return (a1 - a0) / (t1 - t0) if t1 > t0 else None
+
+    def is_moving(self):
+        for hand in self.history:
+            velocity = self.get_velocity(hand)
+            if velocity is not None and np.hypot(velocity[0, 0], velocity[0, 1]) > self.moving_speed:
+                return True
+        return False
+
+    def predict(self, hand, timestamp):
+        """
+        :return: list of 21 Landmark, or None if the hand wasn't being tracked
+        """
+        history = self.history.get(hand)
+        if not history:
+            return None
+        last_time, last = history[-1]
+        velocity = self.get_velocity(hand)
+        if velocity is not None:
+            last = last + velocity * min(timestamp - last_time, self.max_horizon)
+        return [Landmark(*point) for point in last.tolist()]
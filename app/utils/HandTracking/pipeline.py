@@ -0,0 +1,151 @@
+import collections
+import threading
+import time
+
+from .. import metrics
+
+CAPTURE_TIME = metrics.registry.histogram("handtracking_capture_seconds", "Time to read a frame from the frame source")
+CAPTURE_DROPPED = metrics.registry.counter("handtracking_frames_dropped_total",
+                                           "Frames thrown away because a later stage couldn't keep up",
+                                           stage="capture")
+
+# a frame as it came off the frame source: its number (from 1, gaps mean frames were dropped) and the wall clock
+# time it was read, time.time() so it means the same thing in the server and clients on the same machine
+CapturedFrame = collections.namedtuple("CapturedFrame", ["image", "sequence", "timestamp"])
+
+
+class LatestFrameSlot:
+    """
+    Class LatestFrameSlot:
+
+    Hand-off point between the capture thread and the inference stage. Only ever holds one frame, if a new frame
+    comes in before the last one was taken the old one is thrown away and counted in dropped, so inference always
+    works on the newest frame and never falls behind the camera.
+
+    Attributes
+    ----------
+    dropped : int, frames that were overwritten before anyone took them
+    sequence : int, number of frames put into the slot so far
+    closed : bool, set once the producer has stopped, take() returns None from then on
+
+    Methods
+    -------
+    put(frame, block=False):
+        Stores a frame, replacing any frame nobody took yet unless block is True
+    take(timeout=None):
+        Waits for a frame and removes it from the slot
+    close():
+        Wakes up anyone waiting and stops the slot taking more frames
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self.sequence = 0
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, frame, block=False):
+        """
+        :param frame: the frame to hand over
+        :param block: bool, wait for the last frame to be taken instead of dropping it (for offline sources)
+        """
+        with self._condition:
+            if block:
+                self._condition.wait_for(lambda: self._frame is None or self.closed)
+            if self.closed:
+                return
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self.sequence += 1
+            self._condition.notify_all()
+
+    def take(self, timeout=None):
+        """
+        :param timeout: float seconds to wait, None waits forever
+        :return: the newest frame, or None if the slot was closed or the timeout ran out
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._frame is not None or self.closed, timeout)
+            frame, self._frame = self._frame, None
+            self._condition.notify_all()
+            return frame
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class FrameGrabber:
+    """
+    Class FrameGrabber:
+
+    Reads a FrameSource on its own thread as fast as it produces frames and puts them into a LatestFrameSlot, so
+    waiting on the camera never adds to inference time. Every frame goes in as a CapturedFrame, stamped with its
+    sequence number and capture time the moment it's read.
+
+    Attributes
+    ----------
+    source : FrameSource
+    slot : LatestFrameSlot
+    captured : int, frames read from the source
+    drop_frames : bool, overwrite frames inference hasn't got to yet, otherwise wait for it (no frames lost)
+    """
+
+    def __init__(self, source, slot=None, drop_frames=True):
+        self.source = source
+        self.slot = slot if slot is not None else LatestFrameSlot()
+        self.drop_frames = drop_frames
+        self.captured = 0
+        self.running = False
+        self.thread = threading.Thread(target=self._run, name="FrameGrabber", daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while self.running:
+                with CAPTURE_TIME.time():
+                    rval, frame = self.source.read()
+                if not rval:
+                    break
+                self.captured += 1
+                dropped = self.slot.dropped
+                self.slot.put(CapturedFrame(frame, self.captured, time.time()), block=not self.drop_frames)
+                CAPTURE_DROPPED.inc(self.slot.dropped - dropped)
+        finally:
+            self.running = False
+            self.slot.close()
+
+    def stop(self):
+        self.running = False
+        self.slot.close()
+        if self.thread.is_alive():
+            self.thread.join()
+
+
+class PipelineStats:
+    """
+    Counters for the capture -> inference -> publish pipeline, printed when the tracking loop ends
+    """
+
+    def __init__(self, governor=None):
+        self.governor = governor
+        self.started = time.perf_counter()
+        self.processed = 0
+        self.published = 0
+        self.inference_time = 0.0
+
+    def summary(self, grabber):
+        elapsed = time.perf_counter() - self.started
+        average_inference = self.inference_time / self.processed * 1000 if self.processed else 0
+        summary = (f"captured {grabber.captured} frames, processed {self.processed}, published {self.published}, "
+                   f"dropped {grabber.slot.dropped} in {elapsed:.1f}s "
+                   f"(average inference {average_inference:.1f}ms)")
+        if self.governor is not None:
+            summary += f", governor {self.governor.get_metrics()}"
+        return summary
@@ -0,0 +1,248 @@
+import heapq
+import json
+import math
+
+import numpy as np
+
+# (a, b, c) landmark indices of every joint angle in a pose feature, the angle at b, three per finger from the wrist
+# out, thumb first. Unlike batchClassify these are full 3D angles, so a curled finger pointing at the camera still
+# looks curled
+_JOINT_A = np.array([0, 1, 2, 0, 5, 6, 0, 9, 10, 0, 13, 14, 0, 17, 18])
+_JOINT_B = np.array([1, 2, 3, 5, 6, 7, 9, 10, 11, 13, 14, 15, 17, 18, 19])
+_JOINT_C = np.array([2, 3, 4, 6, 7, 8, 10, 11, 12, 14, 15, 16, 18, 19, 20])
+
+# pairs of landmarks whose distance goes into a pose feature, divided by the size of the palm: every fingertip to the
+# wrist, the thumb tip to every other fingertip (pinches) and neighbouring fingertips (spread)
+_PAIRS = np.array([(0, 4), (0, 8), (0, 12), (0, 16), (0, 20),
+                   (4, 8), (4, 12), (4, 16), (4, 20),
+                   (8, 12), (12, 16), (16, 20)])
+
+FEATURE_LENGTH = len(_JOINT_B) + len(_PAIRS) + 2
+
+
+def get_pose_features(hands, orientation_weight=0.5):
+    """
+    Fixed length feature vectors that don't depend on where the hand is in the frame or how big it is
+
+    :param hands: array (N, 21, 3) or (21, 3) of landmarks, or a list of 21 Landmark
+    :param orientation_weight: float, how much the direction the hand points (wrist -> middle finger) counts,
+        0 to match poses whichever way up the hand is
+    :return: float64 array (N, FEATURE_LENGTH): joint angles (0 folded back to 1 straight), fingertip distances in
+        palm sizes divided by 2, and the hand's direction as a unit vector times orientation_weight
+    """
+    hands = np.asarray(hands, dtype=np.float64).reshape(-1, 21, 3)
+
+    u = hands[:, _JOINT_A] - hands[:, _JOINT_B]
+    v = hands[:, _JOINT_C] - hands[:, _JOINT_B]
+    lengths = np.sqrt((u * u).sum(axis=2) * (v * v).sum(axis=2))
+    cosine = (u * v).sum(axis=2) / np.where(lengths > 0, lengths, 1.0)
+    angles = np.arccos(np.clip(cosine, -1.0, 1.0)) / math.pi
+
+    palm = np.sqrt(((hands[:, 9] - hands[:, 0]) ** 2).sum(axis=1))[:, np.newaxis]
+    palm = np.where(palm > 0, palm, 1.0)
+    pairs = hands[:, _PAIRS[:, 0]] - hands[:, _PAIRS[:, 1]]
+    distances = np.sqrt((pairs * pairs).sum(axis=2)) / (2 * palm)
+
+    direction = hands[:, 9, :2] - hands[:, 0, :2]
+    length = np.sqrt((direction * direction).sum(axis=1))[:, np.newaxis]
+    direction = direction / np.where(length > 0, length, 1.0) * orientation_weight
+
+    return np.concatenate([angles, distances, direction], axis=1)
+
+
+class KDTree:
+    """
+    Class KDTree:
+
+    k-d tree over a fixed set of points for nearest neighbour lookups. Points are split at the median of their widest
+    dimension until at most leaf_size are left in each leaf. A lookup works out the distance to every leaf's bounding
+    box in one numpy operation, then searches leaves nearest first and stops at the first leaf further away than
+    the k best points found so far. Splitting planes alone barely prune anything with as many dimensions as a pose
+    feature has, the boxes are much tighter.
+
+    Attributes
+    ----------
+    points : float64 array (N, D), in tree order, each leaf's points next to each other
+    indices : int array (N,), position of each point in the array the tree was built from
+
+    Methods
+    -------
+    query(point, k=1, max_distance=inf):
+        The k nearest points no further away than max_distance
+    """
+
+    def __init__(self, points, leaf_size=32):
+        """
+        :param points: array (N, D)
+        :param leaf_size: int, most points in a leaf
+        """
+        points = np.asarray(points, dtype=np.float64)
+        self.indices = np.arange(len(points))
+        self._leaves = []  # (start, end) in tree order
+        if len(points):
+            self._build(points, 0, len(points), leaf_size)
+        self.points = points[self.indices]
+        self._lower = np.array([self.points[start:end].min(axis=0) for start, end in self._leaves])
+        self._upper = np.array([self.points[start:end].max(axis=0) for start, end in self._leaves])
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _build(self, points, start, end, leaf_size):
+        if end - start <= leaf_size:
+            self._leaves.append((start, end))
+            return
+
+        subset = points[self.indices[start:end]]
+        dimension = int(np.argmax(subset.max(axis=0) - subset.min(axis=0)))
+        middle = (end - start) // 2
+        order = np.argpartition(subset[:, dimension], middle)
+        self.indices[start:end] = self.indices[start:end][order]
+        self._build(points, start, start + middle, leaf_size)
+        self._build(points, start + middle, end, leaf_size)
+
+    def query(self, point, k=1, max_distance=math.inf):
+        """
+        :param point: array (D,)
+        :param k: int, neighbours to find
+        :param max_distance: float, points further away than this are never returned
+        :return: list of (distance, index into the original points), nearest first, shorter than k if there
+            weren't k points within max_distance
+        """
+        if not self._leaves:
+            return []
+        point = np.asarray(point, dtype=np.float64)
+        worst = max_distance * max_distance  # squared distance a point has to beat to get in
+
+        # squared distance from the point to each leaf's box, 0 if it's inside
+        gap = np.maximum(self._lower - point, 0) + np.maximum(point - self._upper, 0)
+        box_distances = (gap * gap).sum(axis=1)
+        near = np.flatnonzero(box_distances <= worst)
+
+        best = []  # heap of (-squared distance, tree position), the worst of the k best on top
+        for leaf in near[np.argsort(box_distances[near])]:
+            if box_distances[leaf] > worst:
+                break  # every leaf left is further away than what's been found
+            start, end = self._leaves[leaf]
+            distances = ((self.points[start:end] - point) ** 2).sum(axis=1)
+            for position in np.flatnonzero(distances <= worst):
+                entry = (-distances[position], start + position)
+                if len(best) < k:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+            if len(best) == k:
+                worst = min(worst, -best[0][0])
+        return [(math.sqrt(-distance), int(self.indices[position]))
+                for distance, position in sorted(best, reverse=True)]
+
+
+class PoseClassifier:
+    """
+    Class PoseClassifier:
+
+    Matches hands against a library of recorded example poses instead of finger up/down templates, so it can tell
+    apart poses that have the same fingers extended, like a pinch and an open C. Every example is turned into a
+    feature vector (see get_pose_features) and put in a KDTree, a hand gets the name of the nearest examples, or
+    None if none are within max_distance.
+
+    Examples are added with add() and saved with save(), libraries are json files like
+    {"max_distance": 0.3, "poses": [{"name": "Pinch", "landmarks": [[x, y, z], ... 21 of them]}, ...]}
+
+    Attributes
+    ----------
+    names : list[str], every pose name in the library
+    max_distance : float, examples further than this from a hand (in feature space) don't count
+    k : int, examples that vote on a hand's pose
+    orientation_weight : float, see get_pose_features
+
+    Methods
+    -------
+    add(name, landmarks):
+        Adds an example pose
+    classify(landmarks):
+        Name of the pose a hand is in, or None
+    classify_many(hands):
+        classify for an array of hands
+    save(path):
+        Writes the library to a json file
+    """
+
+    def __init__(self, max_distance=0.3, k=1, orientation_weight=0.5, leaf_size=32):
+        self.max_distance = max_distance
+        self.k = k
+        self.orientation_weight = orientation_weight
+        self.leaf_size = leaf_size
+        self.names = []
+        self._examples = []  # (name id, (21, 3) landmarks)
+        self._tree = None  # rebuilt on the first lookup after examples change
+
+    def __len__(self):
+        return len(self._examples)
+
+    def add(self, name, landmarks):
+        """
+        :param name: str, name of the pose
+        :param landmarks: 21 Landmark, or an array (21, 3)
+        """
+        if name not in self.names:
+            self.names.append(name)
+        self._examples.append((self.names.index(name), np.asarray(landmarks, dtype=np.float64).reshape(21, 3)))
+        self._tree = None
+
+    def _get_tree(self):
+        if self._tree is None:
+            hands = np.array([landmarks for _, landmarks in self._examples]).reshape(-1, 21, 3)
+            self._tree = KDTree(get_pose_features(hands, self.orientation_weight), self.leaf_size)
+            self._labels = np.array([name_id for name_id, _ in self._examples], dtype=np.intp)
+        return self._tree
+
+    def _vote(self, neighbours):
+        if not neighbours:
+            return None
+        if len(neighbours) == 1:
+            return self.names[self._labels[neighbours[0][1]]]
+        votes = {}
+        for distance, index in neighbours:
+            # ties go to the pose with the nearest example, which comes first
+            votes[self._labels[index]] = votes.get(self._labels[index], 0) + 1
+        return self.names[max(votes, key=votes.get)]
+
+    def classify(self, landmarks):
+        """
+        :param landmarks: 21 Landmark, or an array (21, 3)
+        :return: str, name of the pose, or None if nothing in the library is close enough
+        """
+        tree = self._get_tree()
+        features = get_pose_features(landmarks, self.orientation_weight)[0]
+        return self._vote(tree.query(features, self.k, self.max_distance))
+
+    def classify_many(self, hands):
+        """
+        :param hands: array (N, 21, 3) of landmarks
+        :return: list of N pose names or None
+        """
+        tree = self._get_tree()
+        features = get_pose_features(hands, self.orientation_weight)
+        return [self._vote(tree.query(row, self.k, self.max_distance)) for row in features]
+
+    def save(self, path):
+        with open(path, "w") as file:
+            json.dump({"max_distance": self.max_distance,
+                       "poses": [{"name": self.names[name_id], "landmarks": landmarks.tolist()}
+                                 for name_id, landmarks in self._examples]}, file)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        :param path: str, json library written by save()
+        :param kwargs: passed on to PoseClassifier, max_distance defaults to the one in the file
+        """
+        with open(path) as file:
+            data = json.load(file)
+        if "max_distance" in data:
+            kwargs.setdefault("max_distance", data["max_distance"])
+        classifier = cls(**kwargs)
+        for pose in data["poses"]:
+            classifier.add(pose["name"], pose["landmarks"])
+        return classifier
@@ -0,0 +1,197 @@
+import threading
+
+import cv2
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+from .motionGate import Landmark
+from .pipeline import LatestFrameSlot
+
+# mediapipe labels hands as if the image were mirrored (a selfie view), so on an unflipped frame they come out the
+# wrong way round
+MIRRORED_HANDEDNESS = {"Left": "Right", "Right": "Left"}
+
+
+class FramePreprocessor:
+    """
+    Class FramePreprocessor:
+
+    Gets a camera frame ready for mediapipe without flipping it or allocating a new image every frame. The frame
+    goes through one BGR -> RGB conversion into a buffer that's reused for as long as the frame size stays the same,
+    and landmarks are mirrored afterwards (x -> 1 - x) so they come out the same as if the frame had been flipped.
+
+    With roi on, only the part of the frame around the hands is converted and run through mediapipe. The whole
+    frame is still used every redetect_interval frames (redetecting is set for those), and whenever the crop lost the
+    hands, so hands coming into view elsewhere get picked up. Mediapipe's tracking finds the hands from where they
+    were in the last image, which only works while every image covers the same part of the frame, so the window
+    stays where it is for as long as the hands are well inside it and is only moved when one gets near its edge.
+
+    Attributes
+    ----------
+    roi : bool, crop to the region around the hands when there is one
+    window : (x, y, width, height) in pixels of the part of the frame the last prepare() used
+    redetecting : bool, the last prepare() used the whole frame to look for new hands, in between crops
+    full_frames : int, frames run on the whole frame
+    cropped_frames : int, frames run on a crop
+
+    Methods
+    -------
+    prepare(frame):
+        RGB image to run mediapipe on
+    to_frame_landmarks(landmarks):
+        Turns mediapipe landmarks for the prepared image into mirrored whole frame landmarks
+    update(hands):
+        Picks the region for the next frame from this frame's hands, keeping the current one if they're still in it
+    """
+
+    def __init__(self, roi=False, margin=0.5, min_size=0.25, redetect_interval=15, edge=0.1):
+        """
+        :param roi: bool, crop to the hands
+        :param margin: float, padding added round the hands, as a fraction of the size of the box around them
+        :param min_size: float, smallest crop as a fraction of the frame's width and height
+        :param redetect_interval: int, use the whole frame at least this often
+        :param edge: float, the window is moved once a hand is closer than this fraction of its size to its edge
+        """
+        self.roi = roi
+        self.margin = margin
+        self.min_size = min_size
+        self.redetect_interval = redetect_interval
+        self.edge = edge
+
+        self._buffer = np.empty(0, np.uint8)
+        self._next_window = None  # window to use for the next frame, None for the whole frame
+        self._frames_since_full = 0
+        self.frame_size = None  # (width, height)
+        self.window = None
+        self.redetecting = False
+        self.full_frames = 0
+        self.cropped_frames = 0
+
+    def prepare(self, frame):
+        """
+        :param frame: BGR frame, never modified
+        :return: RGB image, a view onto the reused buffer, only valid until the next call
+        """
+        height, width = frame.shape[:2]
+        if self.frame_size != (width, height):
+            self.frame_size = (width, height)
+            self._buffer = np.empty(height * width * 3, np.uint8)
+            self._next_window = None
+
+        if self._next_window is None or self._frames_since_full >= self.redetect_interval:
+            self.redetecting = self._next_window is not None
+            self.window = (0, 0, width, height)
+            self._frames_since_full = 0
+            self.full_frames += 1
+        else:
+            self.redetecting = False
+            self.window = self._next_window
+            self._frames_since_full += 1
+            self.cropped_frames += 1
+
+        x, y, w, h = self.window
+        crop = frame[y:y + h, x:x + w]  # a view, nothing copied yet
+        # contiguous view onto the start of the buffer, cvtColor writes straight into it
+        image = self._buffer[:h * w * 3].reshape(h, w, 3)
+        cv2.cvtColor(crop, cv2.COLOR_BGR2RGB, dst=image)
+        image.flags.writeable = False  # lets mediapipe use it without copying
+        return image
+
+    def to_frame_landmarks(self, landmarks):
+        """
+        :param landmarks: mediapipe landmarks from the image prepare() returned
+        :return: list of 21 Landmark, relative to the whole frame and mirrored
+        """
+        x, y, w, h = self.window
+        width, height = self.frame_size
+        scale_x, scale_y = w / width, h / height
+        offset_x, offset_y = x / width, y / height
+        return [Landmark(1 - (offset_x + lm.x * scale_x), offset_y + lm.y * scale_y, lm.z * scale_x)
+                for lm in landmarks]
+
+    def update(self, hands):
+        """
+        :param hands: list of landmark lists from to_frame_landmarks (mirrored), empty if no hands were found
+        """
+        if not self.roi or not hands:
+            self._next_window = None
+            return
+
+        points = np.array([(1 - lm.x, lm.y) for landmarks in hands for lm in landmarks])
+        low, high = points.min(axis=0), points.max(axis=0)
+        width, height = self.frame_size
+
+        if self._next_window is not None:
+            x, y, w, h = self._next_window
+            inner_low = np.array([(x + self.edge * w) / width, (y + self.edge * h) / height])
+            inner_high = np.array([(x + (1 - self.edge) * w) / width, (y + (1 - self.edge) * h) / height])
+            if (low >= inner_low).all() and (high <= inner_high).all():
+                return  # still well inside, moving the window would throw mediapipe's tracking off
+
+        size = np.maximum((high - low) * (1 + 2 * self.margin), self.min_size)
+        centre = (low + high) / 2
+        low, high = np.clip(centre - size / 2, 0, 1), np.clip(centre + size / 2, 0, 1)
+
+        x0, y0 = int(low[0] * width), int(low[1] * height)
+        x1, y1 = int(np.ceil(high[0] * width)), int(np.ceil(high[1] * height))
+        self._next_window = (x0, y0, x1 - x0, y1 - y0)
+
+
+class OverlayRenderer:
+    """
+    Class OverlayRenderer:
+
+    Draws the preview (mirrored frame, landmarks and gesture names) on its own thread, so the tracking loop never
+    spends time on pixels nobody might be looking at. Only the newest frame is drawn, if the loop submits frames
+    faster than they can be drawn the older ones are skipped. The window itself still has to be shown from the
+    tracking loop, latest is the newest finished image.
+    """
+
+    def __init__(self, mp_hands, mp_drawing, mp_drawing_styles, font):
+        self.mp_hands = mp_hands
+        self.mp_drawing = mp_drawing
+        self.mp_drawing_styles = mp_drawing_styles
+        self.font = font
+        self.latest = None
+        self._slot = LatestFrameSlot()
+        self._thread = threading.Thread(target=self._run, name="overlay", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, frame, hands):
+        """
+        :param frame: BGR frame, unflipped
+        :param hands: list of (hand label, mirrored Landmark list or None, gesture name)
+        """
+        self._slot.put((frame, hands))
+
+    def _run(self):
+        while True:
+            item = self._slot.take()
+            if item is None:
+                break
+            self.latest = self.render(*item)
+
+    def render(self, frame, hands):
+        image = cv2.flip(frame, 1)  # the one copy of the frame, the preview is mirrored like a selfie view
+        for hand, landmarks, gesture in hands:
+            if landmarks is None:
+                continue
+            landmark_list = landmark_pb2.NormalizedLandmarkList(
+                landmark=[landmark_pb2.NormalizedLandmark(x=lm.x, y=lm.y, z=lm.z) for lm in landmarks])
+            self.mp_drawing.draw_landmarks(
+                image,
+                landmark_list,
+                self.mp_hands.HAND_CONNECTIONS,
+                self.mp_drawing_styles.get_default_hand_landmarks_style(),
+                self.mp_drawing_styles.get_default_hand_connections_style()
+            )
+            cv2.putText(image, gesture, (50, 50) if hand == "Left" else (400, 50), self.font, 1, (255, 0, 255), 2,
+                        cv2.LINE_AA)
+        return image
+
+    def stop(self):
+        self._slot.close()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from .gestureRegistry import ORIENTATIONS
+
+MAGIC = b"HTRK"
+VERSION = 1
+HANDS = ("Left", "Right")
+
+# one fixed size record per published frame, hands are always stored in HANDS order
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f8"),  # time.time() when the frame was processed
+    ("present", "u1", (2,)),  # 1 if the hand was tracked in this frame
+    ("gesture", "<u2", (2,)),  # index into the gesture names in the file header
+    ("orientation", "i1", (2,)),  # index into ORIENTATIONS, -1 for "None"
+    ("landmarks", "<f4", (2, 21, 3)),
+])
+
+# magic, version, record size, length of the json gesture name list that follows
+_HEADER = struct.Struct("<4sHHI")
+
+
+class LandmarkRecorder:
+    """
+    Class LandmarkRecorder:
+
+    Appends every published frame to a binary file of fixed size records (see RECORD_DTYPE) so a session can be
+    replayed later with LandmarkReplay, without a camera or mediapipe.
+
+    Methods
+    -------
+    record(timestamp, left, right):
+        Appends one frame
+    close():
+        Flushes and closes the file
+    """
+
+    def __init__(self, path, gesture_names):
+        """
+        :param path: str, file to write, overwritten if it exists
+        :param gesture_names: list[str], gesture id -> name, normally GestureRegistry.names
+        """
+        self.path = path
+        self.gesture_names = list(gesture_names)
+        self._gesture_ids = {name: i for i, name in enumerate(self.gesture_names)}
+        self.frames = 0
+
+        names = json.dumps(self.gesture_names).encode()
+        self.file = open(path, "wb")
+        self.file.write(_HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize, len(names)))
+        self.file.write(names)
+        self._record = np.zeros(1, dtype=RECORD_DTYPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, timestamp, left, right):
+        """
+        :param timestamp: float, time.time() of the frame
+        :param left: (landmarks, gesture name, orientation) for the left hand, landmarks None if it wasn't tracked
+        :param right: same for the right hand
+        """
+        record = self._record[0]
+        record["timestamp"] = timestamp
+        for i, (landmarks, gesture, orientation) in enumerate((left, right)):
+            record["present"][i] = landmarks is not None
+            record["gesture"][i] = self._gesture_ids.get(gesture, 0)
+            record["orientation"][i] = ORIENTATIONS.index(orientation) if orientation in ORIENTATIONS else -1
+            if landmarks is None:
+                record["landmarks"][i] = 0
+            elif isinstance(landmarks, np.ndarray):
+                record["landmarks"][i] = landmarks
+            else:
+                record["landmarks"][i] = [(lm.x, lm.y, lm.z) for lm in landmarks]
+        self.file.write(self._record.tobytes())
+        self.frames += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+class LandmarkReplay:
+    """
+    Class LandmarkReplay:
+
+    Memory maps a file written by LandmarkRecorder and republishes it in the same json format the tracker sends.
+
+    Attributes
+    ----------
+    records : numpy memmap of RECORD_DTYPE
+    gesture_names : list[str]
+
+    Methods
+    -------
+    get_output(index):
+        Rebuilds the output dict the tracker sent for a frame
+    replay(websocket_client, speed=1.0, loop=False):
+        Sends every frame through websocket_client.send_message with the original timing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            magic, version, record_size, names_length = _HEADER.unpack(file.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a landmark recording")
+            if version != VERSION or record_size != RECORD_DTYPE.itemsize:
+                raise ValueError(f"{path} is recording version {version}, expected {VERSION}")
+            self.gesture_names = json.loads(file.read(names_length))
+
+        offset = _HEADER.size + names_length
+        if os.path.getsize(path) > offset:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=offset)
+        else:
+            self.records = np.zeros(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def get_output(self, index):
+        """
+        :param index: int, frame number
+        :return: dict in the same shape mainloop sends
+        """
+        record = self.records[index]
+        output = {}
+        for i, hand in enumerate(HANDS):
+            if record["present"][i]:
+                landmarks = {j: {'X': float(x), 'Y': float(y), 'Z': float(z)}
+                             for j, (x, y, z) in enumerate(record["landmarks"][i].tolist())}
+            else:
+                landmarks = "None"
+            orientation = int(record["orientation"][i])
+            output[hand] = {
+                "Landmarks": landmarks,
+                "Gesture": self.gesture_names[record["gesture"][i]],
+                "Orientation": ORIENTATIONS[orientation] if orientation >= 0 else "None"
+            }
+        return output
+
+    async def replay(self, websocket_client, speed=1.0, loop=False):
+        """
+        :param websocket_client: anything with send_message(str), e.g. WebSocketManager
+        :param speed: float, 1 is the original speed, 2 twice as fast, 0 as fast as possible
+        :param loop: bool, start again from the beginning at the end
+        """
+        if len(self.records) == 0:
+            print(f"{self.path} has no frames to replay")
+            return
+
+        timestamps = self.records["timestamp"]
+        while True:
+            started = time.perf_counter()
+            for i in range(len(self.records)):
+                if speed:
+                    delay = started + (timestamps[i] - timestamps[0]) / speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                websocket_client.send_message(json.dumps(self.get_output(i)))
+                if not speed and i % 100 == 0:
+                    await asyncio.sleep(0)  # let the rest of the loop breathe when going flat out
+            if not loop:
+                break
@@ -0,0 +1,240 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .frameSources import FrameSource, open_frame_source
+
+# Shared memory layout: a small int64 header followed by the frame slots
+#   header[0]  sequence number of the newest frame written, 0 before the first one
+#   header[1]  1 once the writer has stopped
+#   header[2 + i]  sequence number of the frame in slot i, -1 while it's being written
+# Frame n always goes in slot (n - 1) % slots, so a reader can tell from the sequence number alone where a frame is
+# and whether it's been overwritten since.
+HEADER_FIELDS = 2
+NEWEST = 0
+CLOSED = 1
+WRITING = -1
+
+
+class SharedFrameRing:
+    """
+    Class SharedFrameRing:
+
+    A ring of preallocated frame slots in shared memory, for handing frames from a capture process to one or more
+    inference processes without pickling them through a pipe. The writer copies each frame into the next slot once
+    and readers get numpy views straight onto the shared memory.
+
+    The writer never waits for readers (a camera can't be paused), it just overwrites the oldest slot. A reader that
+    falls more than slots - 1 frames behind has missed frames, read() skips them and counts them in skipped. A view
+    handed out by read() stays valid until the writer comes round to its slot again, is_current() says whether it
+    still is.
+
+    Attributes
+    ----------
+    name : str, shared memory block name, pass it to SharedFrameRing.attach in another process
+    slots : int, number of frame slots
+    shape : tuple, shape of every frame
+    dtype : numpy dtype of the frames
+    skipped : int, frames this reader missed because the writer lapped it
+
+    Methods
+    -------
+    write(frame):
+        Copies a frame into the next slot, returns its sequence number
+    read(after=0, latest=True, timeout=None):
+        Waits for a frame newer than after, returns (sequence, view)
+    is_current(sequence):
+        True if the frame with that sequence number hasn't been overwritten
+    close():
+        Writer side, tells readers no more frames are coming
+    release():
+        Lets go of the shared memory, and frees it if this is the process that created it
+    """
+
+    def __init__(self, shape, dtype=np.uint8, slots=8, name=None, create=True):
+        """
+        :param shape: tuple, shape of a frame, e.g. (1080, 1920, 3)
+        :param dtype: numpy dtype of a frame
+        :param slots: int, frames kept, readers can fall slots - 1 frames behind before they miss any
+        :param name: str, shared memory name, picked automatically when creating
+        :param create: bool, create the shared memory (writer) or attach to an existing block (reader)
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.created = create
+        self.skipped = 0
+
+        frame_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        header_size = (HEADER_FIELDS + slots) * 8
+        self.memory = shared_memory.SharedMemory(name, create, header_size + frame_size * slots)
+        self.name = self.memory.name
+        self.header = np.ndarray((HEADER_FIELDS + slots,), np.int64, self.memory.buf)
+        self.frames = np.ndarray((slots, *self.shape), self.dtype, self.memory.buf, header_size)
+        if create:
+            self.header[:] = 0
+
+    @classmethod
+    def attach(cls, name, shape, dtype=np.uint8, slots=8):
+        return cls(shape, dtype, slots, name, create=False)
+
+    def __reduce__(self):
+        # pickles as "attach to the same block", so a ring can be passed to a process it wasn't created in
+        return SharedFrameRing.attach, (self.name, self.shape, self.dtype.str, self.slots)
+
+    def _slot(self, sequence):
+        return (sequence - 1) % self.slots
+
+    @property
+    def newest(self):
+        return int(self.header[NEWEST])
+
+    @property
+    def closed(self):
+        return bool(self.header[CLOSED])
+
+    def write(self, frame):
+        """
+        :param frame: numpy array, same shape and dtype as the ring
+        :return: int, the frame's sequence number
+        """
+        sequence = self.newest + 1
+        slot = self._slot(sequence)
+        # mark the slot as being written first, so a reader that already has a view onto it can see it's gone
+        self.header[HEADER_FIELDS + slot] = WRITING
+        np.copyto(self.frames[slot], frame)
+        self.header[HEADER_FIELDS + slot] = sequence
+        self.header[NEWEST] = sequence
+        return sequence
+
+    def is_current(self, sequence):
+        return self.header[HEADER_FIELDS + self._slot(sequence)] == sequence
+
+    def read(self, after=0, latest=True, timeout=None, poll_interval=0.001):
+        """
+        :param after: int, sequence number of the last frame this reader got
+        :param latest: bool, jump straight to the newest frame (skipping any in between), otherwise read every
+                       frame in order and only skip the ones that were overwritten before they could be read
+        :param timeout: float, seconds to wait for a new frame, None waits forever
+        :return: (sequence, frame view), or (None, None) if the writer stopped or the timeout ran out
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            newest = self.newest
+            if newest > after:
+                oldest_kept = max(1, newest - self.slots + 2)  # the oldest slot might be getting overwritten
+                sequence = newest if latest else max(after + 1, oldest_kept)
+                if self.is_current(sequence):
+                    self.skipped += sequence - after - 1
+                    return sequence, self.frames[self._slot(sequence)]
+                continue  # lapped while picking it, try again
+            if self.closed or (deadline is not None and time.perf_counter() > deadline):
+                return None, None
+            # there's no cross process condition variable to wait on, and 1ms is well under a frame
+            time.sleep(poll_interval)
+
+    def close(self):
+        self.header[CLOSED] = 1
+
+    def release(self):
+        # views onto the buffer have to go before the memory can be closed
+        del self.header, self.frames
+        self.memory.close()
+        if self.created:
+            self.memory.unlink()
+
+
+class SharedFrameSource(FrameSource):
+    """
+    Class SharedFrameSource:
+
+    FrameSource reading from a SharedFrameRing another process is capturing into, so HandTrackingMain can run in an
+    inference process of its own. Always hands out the newest frame, frames it was too slow for are counted in
+    ring.skipped.
+
+    Every frame is copied out of the ring, the grabber thread, motion gate and overlay all hold on to frames for
+    longer than the writer takes to come round to the slot again. The copy is checked with ring.is_current
+    afterwards, and if the writer got to the slot while it was being made the frame is torn, so it's thrown away
+    (counted in lapped) and the next newest one read instead.
+    """
+
+    live = True
+
+    def __init__(self, ring, timeout=5.0):
+        """
+        :param ring: SharedFrameRing, usually from start_capture_process
+        :param timeout: float, seconds without a new frame before the source counts as finished
+        """
+        self.ring = ring
+        self.timeout = timeout
+        self.sequence = 0
+        self.lapped = 0  # frames overwritten while they were being copied out
+
+    def __repr__(self):
+        return f"SharedFrameSource({self.ring.name!r})"
+
+    def isOpened(self):
+        return not (self.ring.closed and self.ring.newest <= self.sequence)
+
+    def read(self):
+        while True:
+            sequence, view = self.ring.read(self.sequence, latest=True, timeout=self.timeout)
+            if sequence is None:
+                return False, None
+            frame = view.copy()
+            self.sequence = sequence
+            if self.ring.is_current(sequence):
+                return True, frame
+            self.lapped += 1
+
+    def release(self):
+        self.ring.release()
+
+
+def _capture(frame_source, slots, connection):
+    # capture process: opens the source, sizes the ring from the first frame and keeps writing into it
+    source = open_frame_source(frame_source)
+    rval, frame = source.read() if source.isOpened() else (False, None)
+    if not rval:
+        connection.send(None)
+        return
+
+    ring = SharedFrameRing(frame.shape, frame.dtype, slots)
+    connection.send(ring)
+    try:
+        while rval:
+            ring.write(frame)
+            rval, frame = source.read()
+    finally:
+        ring.close()
+        source.release()
+        try:
+            connection.recv()  # wait for the parent to say it's done with the ring before it's freed
+        except EOFError:
+            pass
+        ring.release()
+
+
+def start_capture_process(frame_source, slots=8, timeout=10.0):
+    """
+    Starts a process capturing from frame_source into a new SharedFrameRing
+
+    :param frame_source: camera index, video file or folder of images, see open_frame_source
+    :param slots: int, size of the ring
+    :param timeout: float, seconds to wait for the first frame
+    :return: (process, ring, connection) - send anything down connection once every reader is done with the ring
+             so the capture process can free it
+    """
+    parent, child = multiprocessing.get_context("spawn").Pipe()
+    process = multiprocessing.get_context("spawn").Process(target=_capture, args=(frame_source, slots, child),
+                                                           name=f"capture-{frame_source}", daemon=True)
+    process.start()
+    if not parent.poll(timeout):
+        process.terminate()
+        raise RuntimeError(f"no frames from {frame_source!r} after {timeout}s")
+    ring = parent.recv()
+    if ring is None:
+        raise RuntimeError(f"couldn't read from {frame_source!r}")
+    return process, ring, parent
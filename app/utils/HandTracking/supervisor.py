@@ -0,0 +1,163 @@
+import asyncio
+import multiprocessing
+import queue
+import threading
+
+from .. import metrics
+from .sharedFrames import SharedFrameSource, start_capture_process
+
+
+class QueuePublisher:
+    """
+    Class QueuePublisher:
+
+    What a worker process publishes to instead of a websocket: frames go into a multiprocessing queue the supervisor
+    reads from. Has the same send_message as the other publishers. Never waits, if the queue is full the frame is
+    dropped and counted in dropped.
+    """
+
+    def __init__(self, frame_queue):
+        self.frame_queue = frame_queue
+        self.published = 0
+        self.dropped = 0
+
+    def send_message(self, message):
+        try:
+            self.frame_queue.put_nowait(message)
+            self.published += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+def run_worker(source_id, frame_source, frame_queue, options):
+    """
+    Entry point of a worker process, tracks one frame source and publishes to frame_queue
+
+    :param source_id: str, goes into every frame as "Source"
+    :param frame_source: camera index, video file or folder of images, see open_frame_source
+    :param frame_queue: multiprocessing queue the supervisor reads frames from
+    :param options: dict of extra keyword arguments for handTrack.main, e.g. motion_gate or governor
+    """
+    print(f"Tracker worker for source {source_id!r} starting on {frame_source!r}")
+    startup = metrics.StartupTimer(f"tracker {source_id}")
+    # only the workers need mediapipe and cv2, the supervisor never loads them
+    from .handTrack import main
+    startup.mark("imports")
+    asyncio.run(main(QueuePublisher(frame_queue), frame_source, source_id=source_id, startup=startup, **options))
+
+
+class TrackerSupervisor:
+    """
+    Class TrackerSupervisor:
+
+    Runs one tracker worker process per camera/stream, each with its own frame source and mediapipe instance, and
+    merges their frames into one publisher (usually local_publisher, so they all end up in the same socket server
+    broadcast). Every frame is tagged with the "Source" id of the worker it came from, so clients can subscribe to
+    single sources, see SocketServer.parse_handshake. Workers that crash are restarted, up to max_restarts times each.
+
+    With shared_capture every source also gets a capture process writing into a SharedFrameRing, and the worker
+    reads frames out of shared memory, so a worker restarting doesn't mean reopening the camera.
+
+    Attributes
+    ----------
+    sources : dict, source id -> frame source (camera index, video file, folder of images)
+    publisher : anything with send_message(dict), frames from every worker are sent to it
+    options : dict, passed on to handTrack.main in every worker
+    workers : dict, source id -> multiprocessing.Process
+    restarts : dict, source id -> times that worker has been restarted
+
+    Methods
+    -------
+    start():
+        Starts the workers and the thread forwarding their frames to the publisher
+    run():
+        Starts everything and watches the workers until they've all finished
+    stop():
+        Stops the workers
+    """
+
+    def __init__(self, sources, publisher, queue_size=64, max_restarts=3, shared_capture=False, **options):
+        """
+        :param sources: dict of source id -> frame source
+        :param publisher: LocalPublisher, WebSocketManager or anything else with send_message
+        :param queue_size: int, frames that can wait for the forwarding thread before workers start dropping them
+        :param max_restarts: int, times a crashed worker is restarted before it's given up on
+        :param shared_capture: bool, capture in separate processes and hand frames over through shared memory
+        :param options: extra keyword arguments for handTrack.main, headless is on unless it's passed
+        """
+        self.sources = dict(sources)
+        self.publisher = publisher
+        self.max_restarts = max_restarts
+        self.shared_capture = shared_capture
+        self.options = {"headless": True, **options}
+
+        # spawn rather than fork, mediapipe and the camera backends don't survive being forked
+        self._context = multiprocessing.get_context("spawn")
+        self.frame_queue = self._context.Queue(queue_size)
+        self.workers = dict()
+        self.captures = dict()  # source id -> (capture process, ring, connection), with shared_capture
+        self.restarts = {source_id: 0 for source_id in self.sources}
+        self.forwarded = 0
+        self._forwarder = threading.Thread(target=self._forward, name="tracker-supervisor", daemon=True)
+
+    def _start_worker(self, source_id):
+        frame_source = self.sources[source_id]
+        if source_id in self.captures:
+            frame_source = SharedFrameSource(self.captures[source_id][1])
+        worker = self._context.Process(target=run_worker, name=f"tracker-{source_id}",
+                                       args=(source_id, frame_source, self.frame_queue, self.options))
+        worker.start()
+        self.workers[source_id] = worker
+
+    def _forward(self):
+        # runs on its own thread, moves frames from the workers to the publisher
+        while True:
+            message = self.frame_queue.get()
+            if message is None:
+                break
+            self.publisher.send_message(message)
+            self.forwarded += 1
+
+    def start(self):
+        if self.shared_capture:
+            for source_id, frame_source in self.sources.items():
+                self.captures[source_id] = start_capture_process(frame_source)
+        for source_id in self.sources:
+            self._start_worker(source_id)
+        self._forwarder.start()
+
+    async def run(self, poll_interval=1.0):
+        self.start()
+        try:
+            while self.workers:
+                await asyncio.sleep(poll_interval)
+                for source_id, worker in list(self.workers.items()):
+                    if worker.is_alive():
+                        continue
+                    del self.workers[source_id]
+                    if worker.exitcode == 0:
+                        print(f"Tracker worker for source {source_id!r} finished")
+                    elif self.restarts[source_id] < self.max_restarts:
+                        self.restarts[source_id] += 1
+                        print(f"Tracker worker for source {source_id!r} exited with {worker.exitcode}, "
+                              f"restarting ({self.restarts[source_id]}/{self.max_restarts})")
+                        self._start_worker(source_id)
+                    else:
+                        print(f"Tracker worker for source {source_id!r} keeps crashing, giving up on it")
+        finally:
+            self.stop()
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.terminate()
+        for worker in self.workers.values():
+            worker.join()
+        self.workers.clear()
+        for process, ring, connection in self.captures.values():
+            ring.release()
+            connection.send(True)  # the capture process can free the ring now
+            process.join(5)
+        self.captures.clear()
+        if self._forwarder.is_alive():
+            self.frame_queue.put(None)
+            self._forwarder.join()
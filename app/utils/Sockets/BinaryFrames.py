@@ -0,0 +1,208 @@
+import json
+import struct
+
+# Packed binary frames, the opt-in alternative to the json frames. A client asks for them with ";binary" after its
+# preferences in the handshake, e.g. ":111;binary".
+#
+# Every frame is a 22 byte little endian header followed by float32 landmarks:
+#   magic "HT", version u8, flags u8, sequence u32,
+#   left gesture code u16, left orientation i8, right gesture code u16, right orientation i8,
+#   capture time f64 (unix seconds, 0 if unknown)
+# sequence is the tracker's frame number, counted from when frames are read off the camera, so a gap means frames
+# were dropped somewhere (or had no hands in them), and the capture time gives how old the frame is.
+# flags bit 0 / bit 1 are set when the left / right hand was tracked, bit 2 when landmarks are included, bit 3 when
+# the landmarks were extrapolated rather than detected, bit 4 when either hand has dynamic gesture events, bit 5
+# when the frame names the camera it came from. If landmarks are included, 21 * (x, y, z) float32s follow for each
+# tracked hand, left first. If there are events, a u16 bit mask for each hand follows that, left first, bit i set for
+# EVENTS[i]. Last comes the source, a u8 length and that many bytes of utf-8.
+#
+# Gesture codes index into a table sent as a text message, {"Gestures": [...], "Orientations": [...], "Events":
+# [...]}, once after the handshake and again whenever a new gesture name shows up. Orientation -1 means "None".
+# Events are the ones DynamicGestureDetector emits, any other name is left out of binary frames.
+
+VERSION = 3
+MAGIC = b"HT"
+HANDS = ("Left", "Right")
+ORIENTATIONS = ("up", "down", "left", "right")
+EVENTS = ("SwipeLeft", "SwipeRight", "SwipeUp", "SwipeDown", "CircleClockwise", "CircleCounterClockwise", "Wave",
+          "PinchDrag")
+
+HEADER = struct.Struct("<2sBBIHbHbd")
+LANDMARKS = struct.Struct("<63f")
+EVENT_MASKS = struct.Struct("<HH")
+SOURCE_LENGTH = struct.Struct("<B")
+
+FLAG_LEFT = 1
+FLAG_RIGHT = 2
+FLAG_LANDMARKS = 4
+FLAG_PREDICTED = 8
+FLAG_EVENTS = 16
+FLAG_SOURCE = 32
+
+
+def is_table_message(data):
+    """
+    :param data: dict, a parsed text message
+    :return: True if it's a gesture code table rather than a frame
+    """
+    return isinstance(data, dict) and "Gestures" in data and "Left" not in data
+
+
+def _orientation_code(orientation):
+    return ORIENTATIONS.index(orientation) if orientation in ORIENTATIONS else -1
+
+
+def _event_mask(events):
+    return sum(1 << EVENTS.index(event) for event in set(events) if event in EVENTS)
+
+
+class BinaryFrameEncoder:
+    """
+    Class BinaryFrameEncoder:
+
+    Turns frames (the dict the tracker builds) into packed binary frames. Keeps the gesture code table, so one
+    encoder should be used for everything sent to the same set of receivers.
+
+    Methods
+    -------
+    add_gestures(data):
+        Gives any new gesture names in a frame a code, True if the table grew
+    get_table_message():
+        The text message receivers need to turn gesture codes back into names
+    encode(data, preferences="111", sequence=None):
+        Packs one frame
+    """
+
+    def __init__(self):
+        self.gestures = ["None"]
+        self._codes = {"None": 0}
+        self.sequence = 0
+
+    def add_gestures(self, data):
+        grew = False
+        for hand in HANDS:
+            name = data[hand]["Gesture"]
+            if name not in self._codes:
+                self._codes[name] = len(self.gestures)
+                self.gestures.append(name)
+                grew = True
+        return grew
+
+    def get_table_message(self):
+        return json.dumps({"Version": VERSION, "Gestures": self.gestures, "Orientations": list(ORIENTATIONS),
+                           "Events": list(EVENTS)})
+
+    def next_sequence(self):
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        return self.sequence
+
+    def encode(self, data, preferences="111", sequence=None):
+        """
+        :param data: dict, frame in the same shape the tracker sends as json
+        :param preferences: str, same meaning as the json preferences (landmarks, orientation, gesture)
+        :param sequence: int, frame number to put in the header, the frame's own "Sequence" if None, and if it
+                         doesn't have one the encoder counts on its own
+        :return: bytes
+        """
+        if sequence is None:
+            sequence = data["Sequence"] & 0xFFFFFFFF if "Sequence" in data else self.next_sequence()
+        self.add_gestures(data)
+
+        flags = 0
+        codes = []
+        floats = []
+        masks = []
+        for i, hand in enumerate(HANDS):
+            hand_data = data[hand]
+            landmarks = hand_data["Landmarks"]
+            if landmarks != "None" and landmarks is not None:
+                flags |= FLAG_LEFT if i == 0 else FLAG_RIGHT
+                if preferences[0] == '1':
+                    floats.extend(value for point in landmarks.values() for value in (point['X'], point['Y'], point['Z']))
+            codes.append(self._codes[hand_data["Gesture"]] if preferences[2] == '1' else 0)
+            codes.append(_orientation_code(hand_data["Orientation"]) if preferences[1] == '1' else -1)
+            # events go with the gesture, like in the json frames
+            masks.append(_event_mask(hand_data.get("Events", ())) if preferences[2] == '1' else 0)
+
+        if preferences[0] == '1':
+            flags |= FLAG_LANDMARKS
+        if data.get("Predicted"):
+            flags |= FLAG_PREDICTED
+        if any(masks):
+            flags |= FLAG_EVENTS
+        source = str(data["Source"]).encode()[:255] if data.get("Source") is not None else None
+        if source is not None:
+            flags |= FLAG_SOURCE
+        header = HEADER.pack(MAGIC, VERSION, flags, sequence, *codes, data.get("Captured", 0.0))
+        parts = [header, struct.pack(f"<{len(floats)}f", *floats)]
+        if flags & FLAG_EVENTS:
+            parts.append(EVENT_MASKS.pack(*masks))
+        if source is not None:
+            parts.append(SOURCE_LENGTH.pack(len(source)) + source)
+        return b"".join(parts)
+
+
+class BinaryFrameDecoder:
+    """
+    Class BinaryFrameDecoder:
+
+    Turns packed binary frames back into the frame dict, using the gesture table from the sender's last table message
+    """
+
+    def __init__(self):
+        self.gestures = ["None"]
+        self.last_sequence = None
+
+    def update_table(self, data):
+        self.gestures = list(data["Gestures"])
+
+    def decode(self, payload):
+        """
+        :param payload: bytes, one binary frame
+        :return: dict in the same shape as the json frames
+        :raises ValueError: if it isn't a binary frame or is cut short
+        """
+        if len(payload) < HEADER.size:
+            raise ValueError(f"binary frame is {len(payload)} bytes, shorter than the {HEADER.size} byte header")
+        magic, version, flags, sequence, *codes, captured = HEADER.unpack_from(payload)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a version {VERSION} binary frame")
+        self.last_sequence = sequence
+
+        offset = HEADER.size
+        output = {}
+        for i, hand in enumerate(HANDS):
+            gesture, orientation = codes[2 * i], codes[2 * i + 1]
+            landmarks = "None"
+            if flags & (FLAG_LEFT if i == 0 else FLAG_RIGHT) and flags & FLAG_LANDMARKS:
+                if len(payload) < offset + LANDMARKS.size:
+                    raise ValueError(f"binary frame is cut short, {hand} landmarks are missing")
+                values = LANDMARKS.unpack_from(payload, offset)
+                offset += LANDMARKS.size
+                landmarks = {j: {'X': values[3 * j], 'Y': values[3 * j + 1], 'Z': values[3 * j + 2]} for j in range(21)}
+            output[hand] = {
+                "Landmarks": landmarks,
+                "Gesture": self.gestures[gesture] if gesture < len(self.gestures) else "None",
+                "Orientation": ORIENTATIONS[orientation] if orientation >= 0 else "None"
+            }
+        if flags & FLAG_EVENTS:
+            if len(payload) < offset + EVENT_MASKS.size:
+                raise ValueError("binary frame is cut short, events are missing")
+            for hand, mask in zip(HANDS, EVENT_MASKS.unpack_from(payload, offset)):
+                if mask:
+                    output[hand]["Events"] = [event for i, event in enumerate(EVENTS) if mask & (1 << i)]
+            offset += EVENT_MASKS.size
+        if flags & FLAG_SOURCE:
+            if len(payload) < offset + SOURCE_LENGTH.size:
+                raise ValueError("binary frame is cut short, the source is missing")
+            length, = SOURCE_LENGTH.unpack_from(payload, offset)
+            offset += SOURCE_LENGTH.size
+            if len(payload) < offset + length:
+                raise ValueError("binary frame is cut short, the source is missing")
+            output["Source"] = payload[offset:offset + length].decode(errors="replace")
+        if flags & FLAG_PREDICTED:
+            output["Predicted"] = True
+        output["Sequence"] = sequence
+        if captured:
+            output["Captured"] = captured
+        return output
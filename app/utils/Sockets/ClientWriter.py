@@ -0,0 +1,138 @@
+import asyncio
+import collections
+import time
+
+import websockets
+
+from .. import metrics
+
+CLIENT_QUEUE_WAIT = metrics.registry.histogram("handtracking_client_queue_wait_seconds",
+                                               "Time frames wait in a client's outbound queue on the server")
+CLIENT_DROPPED = metrics.registry.counter("handtracking_frames_dropped_total",
+                                          "Frames thrown away because a later stage couldn't keep up", stage="client")
+CLIENTS_EVICTED = metrics.registry.counter("handtracking_clients_evicted_total",
+                                           "Clients disconnected for falling too far behind")
+CAPTURE_TO_CLIENT = metrics.registry.histogram("handtracking_latency_seconds",
+                                               "Time from a frame being captured to it reaching each hop",
+                                               hop="capture_to_client")
+BYTES_SENT = metrics.registry.counter("handtracking_bytes_sent_total", "Bytes of frames sent over websockets",
+                                      side="server")
+
+
+class ClientWriter:
+    """
+    Class ClientWriter:
+
+    Every subscriber gets one of these, a small outbound queue with its own task sending from it, so the broadcast
+    never waits on any one client. When a client can't keep up its queue is conflated: the oldest frame that can be
+    dropped is thrown away to make room for the newest. Messages that must arrive (gesture code tables, delta
+    keyframes) are never dropped, but one can be replaced by a newer message with the same key, e.g. a delta
+    keyframe by the next keyframe. A client that's merely slower than the tracker is fine, it just gets fewer frames,
+    but one that has a full queue and hasn't finished taking a message for max_lag seconds has stalled and is
+    disconnected, and so is one with max_reliable messages that can't be dropped waiting.
+
+    Attributes
+    ----------
+    client : websocket connection
+    maxsize : int, frames that can wait before the oldest is dropped
+    max_lag : float, seconds a client with a full queue can go without a send finishing before it's disconnected,
+        None to never evict for lag
+    max_reliable : int, messages that can't be dropped that can wait before the client is disconnected
+    sent : int, messages sent
+    dropped : int, frames dropped because the client was behind
+    evicted : bool, set once the client has been disconnected for being too slow
+
+    Methods
+    -------
+    push(payload, droppable=True, captured=None, key=None):
+        Queues a message, never waits
+    close():
+        Stops the writer task
+    """
+
+    def __init__(self, client, maxsize=1, max_lag=5.0, max_reliable=64):
+        self.client = client
+        self.maxsize = max(1, maxsize)
+        self.max_lag = max_lag
+        self.max_reliable = max_reliable
+        self.sent = 0
+        self.dropped = 0
+        self.evicted = False
+        self.behind_since = None  # when the queue filled up since the last send finished, None if it hasn't
+        self._queue = collections.deque()  # (payload, droppable, time it was queued, capture time, key)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, payload, droppable=True, captured=None, key=None):
+        """
+        :param payload: str or bytes to send
+        :param droppable: bool, the message can be conflated away if the client is behind
+        :param captured: float, time.time() the frame was captured, for the latency metrics
+        :param key: anything, this message makes a queued one with the same key out of date, it's removed along
+            with every droppable frame queued before this one
+        """
+        if self.evicted:
+            return
+
+        if key is not None and any(entry[4] == key for entry in self._queue):
+            kept = collections.deque(entry for entry in self._queue if not entry[1] and entry[4] != key)
+            self.dropped += len(self._queue) - len(kept)
+            CLIENT_DROPPED.inc(len(self._queue) - len(kept))
+            self._queue = kept
+
+        if len(self._queue) >= self.maxsize:
+            if droppable:
+                # conflate, drop the oldest frame we're allowed to, the client only cares about the newest
+                for i, entry in enumerate(self._queue):
+                    if entry[1]:
+                        del self._queue[i]
+                        self.dropped += 1
+                        CLIENT_DROPPED.inc()
+                        break
+            elif sum(1 for entry in self._queue if not entry[1]) >= self.max_reliable:
+                self.evict()
+                return
+            # a client only sent messages that can't be dropped can stall too, so this counts whatever this one is
+            now = time.monotonic()
+            if self.behind_since is None:
+                self.behind_since = now
+            elif self.max_lag is not None and now - self.behind_since > self.max_lag:
+                self.evict()
+                return
+
+        self._queue.append((payload, droppable, time.perf_counter(), captured, key))
+        self._wakeup.set()
+
+    def evict(self):
+        print(f"Client {self.client} has fallen too far behind ({len(self._queue)} messages waiting, "
+              f"{self.dropped} frames dropped), disconnecting it")
+        self.evicted = True
+        CLIENTS_EVICTED.inc()
+        self._queue.clear()
+        self._task.cancel()
+        # 1013 is "try again later"
+        asyncio.get_running_loop().create_task(self.client.close(1013, "client too slow"))
+
+    async def _run(self):
+        try:
+            while True:
+                while not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                payload, _, queued, captured, _ = self._queue.popleft()
+                CLIENT_QUEUE_WAIT.observe(time.perf_counter() - queued)
+                await self.client.send(payload)
+                if captured is not None:
+                    CAPTURE_TO_CLIENT.observe(time.time() - captured)
+                self.sent += 1
+                BYTES_SENT.inc(metrics.payload_size(payload))
+                # still taking messages, conflation covers a client that's just slow, only a stalled one is evicted
+                self.behind_since = None
+        except websockets.ConnectionClosed:
+            pass
+
+    def close(self):
+        self._task.cancel()
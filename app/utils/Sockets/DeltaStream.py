@@ -0,0 +1,152 @@
+import json
+
+# Quantised, delta encoded json frames for clients on slow links. A client asks for them with ";delta" in the
+# handshake, optionally with settings, e.g. ":111;delta,precision=3,threshold=0.005,keyframe=30,ack"
+#
+# Keyframes carry the whole (quantised) frame:   {"Keyframe": 7, "Left": {...}, "Right": {...}}
+# Deltas only carry what changed since a keyframe: {"Base": 7, "Right": {"Landmarks": {"8": {"X": ..}}}}
+# A field set to null in a delta was removed, e.g. the hand stopped being tracked. Landmark points are only sent
+# when one of their coordinates moved more than threshold away from the keyframe.
+#
+# Deltas are always relative to a keyframe, never to the delta before, so the client only has to keep the last
+# keyframe and apply the newest delta to it. With "ack" the client sends "ack:<keyframe>" once it has a keyframe
+# and deltas stay relative to the last one it acknowledged, otherwise every keyframe counts as acknowledged as soon
+# as it's sent.
+#
+# "Events" on a hand (dynamic gestures, see DynamicGestureDetector) are only about the message they come in, like
+# "Predicted", and never carry over from a keyframe to the deltas based on it.
+
+HANDS = ("Left", "Right")
+COORDINATES = ('X', 'Y', 'Z')
+MAX_UNACKNOWLEDGED_KEYFRAMES = 8
+FRAME_FIELDS = ("Sequence", "Captured")  # different for every frame, sent in deltas as well as keyframes
+
+
+class DeltaStreamEncoder:
+    """
+    Class DeltaStreamEncoder:
+
+    Per client state for a delta stream, one of these for every client that asked for one
+
+    Attributes
+    ----------
+    precision : int, decimal places landmarks are rounded to
+    threshold : float, how far a coordinate has to move before the point is sent again
+    keyframe_interval : int, frames between keyframes
+    wait_for_ack : bool, only use keyframes the client has acknowledged as the base for deltas
+
+    Methods
+    -------
+    encode(data):
+        Turns a projected frame dict into the json to send this client
+    acknowledge(keyframe):
+        Called when the client sends "ack:<keyframe>"
+    """
+
+    def __init__(self, precision=3, threshold=None, keyframe_interval=30, wait_for_ack=False):
+        self.precision = precision
+        # by default a point has to move more than one rounding step, so values sitting on a rounding boundary
+        # don't get resent every frame
+        self.threshold = threshold if threshold is not None else 1.5 * 10 ** -precision
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.wait_for_ack = wait_for_ack
+
+        self.keyframe = 0  # number of the last keyframe sent
+        self.frames_since_keyframe = 0
+        self.sent_keyframe = False  # whether the last thing encode() returned was a keyframe
+        self._sent_keyframes = dict()  # keyframe number -> quantised frame, until the client acknowledges one
+        self.base = None  # (keyframe number, quantised frame) deltas are relative to
+
+    @classmethod
+    def from_options(cls, options):
+        """
+        :param options: dict of handshake options, see SocketServer.parse_handshake
+        :raises ValueError: if a setting isn't a number, or is out of range
+        """
+        try:
+            precision = int(options.get("precision", 3))
+            threshold = float(options["threshold"]) if "threshold" in options else None
+            keyframe_interval = int(options.get("keyframe", 30))
+        except ValueError:
+            raise ValueError("delta precision and keyframe must be whole numbers, threshold a number") from None
+        if precision < 0 or (threshold is not None and threshold < 0) or keyframe_interval < 1:
+            raise ValueError("delta precision and threshold can't be negative, keyframe must be at least 1")
+        return cls(precision, threshold, keyframe_interval, "ack" in options)
+
+    def quantise(self, data):
+        output = {}
+        for hand in HANDS:
+            hand_data = dict(data.get(hand, {}))
+            landmarks = hand_data.get("Landmarks")
+            if isinstance(landmarks, dict):
+                hand_data["Landmarks"] = {str(i): {axis: round(point[axis], self.precision) for axis in COORDINATES}
+                                          for i, point in landmarks.items()}
+            output[hand] = hand_data
+        if data.get("Predicted"):
+            output["Predicted"] = True
+        if "Source" in data:
+            output["Source"] = data["Source"]  # only sent in keyframes, a delta stream should stick to one source
+        for key in FRAME_FIELDS:
+            if key in data:
+                output[key] = data[key]
+        return output
+
+    def acknowledge(self, keyframe):
+        frame = self._sent_keyframes.get(keyframe)
+        if frame is None:
+            return
+        self.base = (keyframe, frame)
+        # older keyframes will never be used as a base again
+        self._sent_keyframes = {k: v for k, v in self._sent_keyframes.items() if k > keyframe}
+
+    def encode(self, data):
+        """
+        :param data: dict, frame already projected for this client's preferences
+        :return: str, json keyframe or delta
+        """
+        frame = self.quantise(data)
+        self.frames_since_keyframe += 1
+
+        self.sent_keyframe = self.base is None or self.frames_since_keyframe >= self.keyframe_interval
+        if self.sent_keyframe:
+            return self._encode_keyframe(frame)
+
+        base_number, base = self.base
+        delta = {"Base": base_number}
+        for hand in HANDS:
+            hand_delta = self._diff_hand(base[hand], frame[hand])
+            if "Events" in frame[hand]:
+                hand_delta["Events"] = frame[hand]["Events"]  # like Predicted, only about this frame
+            if hand_delta:
+                delta[hand] = hand_delta
+        if frame.get("Predicted"):
+            delta["Predicted"] = True  # says something about this frame only, so never left to the keyframe
+        for key in FRAME_FIELDS:
+            if key in frame:
+                delta[key] = frame[key]
+        return json.dumps(delta)
+
+    def _encode_keyframe(self, frame):
+        self.keyframe += 1
+        self.frames_since_keyframe = 0
+        if self.wait_for_ack:
+            self._sent_keyframes[self.keyframe] = frame
+            if len(self._sent_keyframes) > MAX_UNACKNOWLEDGED_KEYFRAMES:
+                # client isn't acknowledging anything, don't keep every keyframe forever
+                self._sent_keyframes.pop(min(self._sent_keyframes))
+        else:
+            self.base = (self.keyframe, frame)
+        return json.dumps({"Keyframe": self.keyframe, **frame})
+
+    def _diff_hand(self, base, current):
+        delta = {}
+        for key in (base.keys() | current.keys()) - {"Events"}:
+            old, new = base.get(key), current.get(key)
+            if key == "Landmarks" and isinstance(old, dict) and isinstance(new, dict):
+                moved = {i: point for i, point in new.items()
+                         if any(abs(point[axis] - old[i][axis]) > self.threshold for axis in COORDINATES)}
+                if moved:
+                    delta[key] = moved
+            elif old != new:
+                delta[key] = new  # None (null) if the field went away
+        return delta
@@ -0,0 +1,164 @@
+import multiprocessing
+import pickle
+import queue
+import socket
+import threading
+import time
+
+from . import SocketServer
+from .SocketPublish import local_publisher
+from .. import metrics
+
+WORKER_DROPPED = metrics.registry.counter("handtracking_frames_dropped_total",
+                                          "Frames thrown away because a later stage couldn't keep up",
+                                          stage="server_worker")
+
+
+def _read_frames(frame_queue):
+    # runs on its own thread in a server worker, hands every frame from the tracker to this worker's server
+    while True:
+        payload = frame_queue.get()
+        if payload is None:
+            break
+        local_publisher.send_message(pickle.loads(payload))
+
+
+def run_server_worker(index, frame_queue, ready, options):
+    """
+    Entry point of a server worker process, runs a socket server on the shared port fed from frame_queue
+
+    :param index: int, which worker this is, only used in messages
+    :param frame_queue: multiprocessing queue of pickled frames from ServerWorkerPool.send_message
+    :param ready: multiprocessing event set once the server is accepting connections
+    :param options: dict of keyword arguments for start_socket_server
+    """
+    print(f"Server worker {index} starting")
+
+    def wait_until_ready():
+        SocketServer.server_ready.wait()
+        ready.set()
+
+    threading.Thread(target=_read_frames, args=(frame_queue,), name="server-worker-frames", daemon=True).start()
+    threading.Thread(target=wait_until_ready, daemon=True).start()
+    SocketServer.start_socket_server(reuse_port=True, **options)
+
+
+class ServerWorkerPool:
+    """
+    Class ServerWorkerPool:
+
+    Runs the socket server in several processes that all listen on the same port (SO_REUSEPORT), so fan-out to
+    clients is spread over as many cores as there are workers instead of sharing one core, and the GIL, with the
+    tracker. The kernel shares new connections out between the workers, and each worker only serves its own clients.
+
+    The pool is the tracker's publisher: send_message pickles a frame once and puts the bytes in every worker's
+    queue, and a thread in each worker hands them to that worker's server like LocalPublisher. It never waits, if a
+    worker's queue is full the frame is dropped for that worker and counted in dropped. Workers that crash are
+    restarted, up to max_restarts times each.
+
+    Frames have to come from the tracker through the pool. A tracker connecting over a websocket (--publish socket)
+    would only reach the clients of whichever worker it landed on. /metrics on the shared port only shows the server
+    side of the worker that answered, the tracker's process has to serve its own (see metrics.start_metrics_server).
+
+    Attributes
+    ----------
+    workers : list of multiprocessing.Process, one per worker
+    restarts : list of int, times each worker has been restarted
+    published : int, frames sent to the workers
+    dropped : int, frames dropped because a worker's queue was full, counted once per worker
+
+    Methods
+    -------
+    start(timeout=None):
+        Starts the workers and waits for them to be accepting connections
+    send_message(message):
+        Sends a frame dict or json string to every worker
+    stop():
+        Stops the workers
+    """
+
+    def __init__(self, workers=2, queue_size=64, max_restarts=3, poll_interval=1.0, **options):
+        """
+        :param workers: int, server processes to run
+        :param queue_size: int, frames that can wait for a worker before they start being dropped
+        :param max_restarts: int, times a crashed worker is restarted before it's given up on
+        :param poll_interval: float, seconds between checks for crashed workers
+        :param options: keyword arguments for start_socket_server in every worker, e.g. port or max_lag
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("server workers need SO_REUSEPORT, which this platform doesn't have")
+        self.options = options
+        self.max_restarts = max_restarts
+        self.poll_interval = poll_interval
+
+        # spawn like TrackerSupervisor, so the workers don't inherit the tracker's threads and camera
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._ready = [self._context.Event() for _ in range(workers)]
+        self.workers = [None] * workers
+        self.restarts = [0] * workers
+        self.published = 0
+        self.dropped = 0
+        self._stopping = threading.Event()
+        self._monitor = threading.Thread(target=self._watch, name="server-workers", daemon=True)
+
+    def _start_worker(self, index):
+        self._ready[index].clear()
+        worker = self._context.Process(target=run_server_worker, name=f"server-{index}",
+                                       args=(index, self._queues[index], self._ready[index], self.options))
+        worker.start()
+        self.workers[index] = worker
+
+    def _watch(self):
+        # runs on its own thread, restarts workers that crash
+        while not self._stopping.wait(self.poll_interval):
+            for index, worker in enumerate(self.workers):
+                if worker is None or worker.is_alive():
+                    continue
+                if self.restarts[index] < self.max_restarts:
+                    self.restarts[index] += 1
+                    print(f"Server worker {index} exited with {worker.exitcode}, "
+                          f"restarting ({self.restarts[index]}/{self.max_restarts})")
+                    self._start_worker(index)
+                else:
+                    print(f"Server worker {index} keeps crashing, giving up on it")
+                    self.workers[index] = None
+
+    def start(self, timeout=None):
+        """
+        :param timeout: float, seconds to wait for the workers, None waits for as long as it takes
+        :return: bool, True if every worker is accepting connections
+        """
+        for index in range(len(self.workers)):
+            self._start_worker(index)
+        self._monitor.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for ready in self._ready:
+            if not ready.wait(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                return False
+        return True
+
+    def send_message(self, message):
+        # called from the tracker's thread, message is a frame dict or a json string
+        payload = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)  # once, however many workers there are
+        for index, frame_queue in enumerate(self._queues):
+            if self.workers[index] is None:
+                continue
+            try:
+                frame_queue.put_nowait(payload)
+            except queue.Full:
+                self.dropped += 1
+                WORKER_DROPPED.inc()
+        self.published += 1
+
+    def stop(self):
+        self._stopping.set()
+        if self._monitor.is_alive():
+            self._monitor.join()
+        for worker in self.workers:
+            if worker is not None:
+                worker.terminate()
+        for worker in self.workers:
+            if worker is not None:
+                worker.join()
+        self.workers = [None] * len(self.workers)
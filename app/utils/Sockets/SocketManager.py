@@ -1,6 +1,5 @@
 import threading
-from queue import Queue
-from app.utils.Sockets.SocketSend import WebSocketThread
+from .SocketSend import WebSocketThread
 
 
 class WebSocketManager:
@@ -18,16 +17,20 @@ class WebSocketManager:
     def __init__(self):
         if not self._initialized:
             self.ws_thread = WebSocketThread()
-            self.message_queue = Queue()
             self._initialized = True
 
-    def start(self):
-        # start the WebSocket thread
+    def start(self, wire_format=None, drop_policy=None, max_queue_size=None):
+        # start the WebSocket thread, wire_format is "json" (default) or "binary", see BinaryFrames
+        # drop_policy and max_queue_size decide what happens to frames when the server can't keep up, see SendQueue
+        if wire_format is not None:
+            self.ws_thread.client.wire_format = wire_format
+        self.ws_thread.message_queue.configure(max_queue_size, drop_policy)
         if not self.ws_thread.thread.is_alive():
             self.ws_thread.start()
 
-    def send_message(self, message: str):
-        # send a message to the WebSocket server
+    def send_message(self, message):
+        # send a message to the WebSocket server, either a json string or a frame dict which gets encoded
+        # in the configured wire format on the websocket thread
         self.ws_thread.send_message(message)
 
     def stop(self):
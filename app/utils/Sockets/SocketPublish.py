@@ -0,0 +1,81 @@
+import json
+import threading
+
+from . import SocketServer
+from .. import metrics
+
+PUBLISHER_DROPPED = metrics.registry.counter("handtracking_frames_dropped_total",
+                                             "Frames thrown away because a later stage couldn't keep up",
+                                             stage="publisher")
+
+
+def _carry_events(old, new):
+    # dynamic gesture events only come in one frame, so they move to the frame that replaced it rather than be lost
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return
+    for hand in ("Left", "Right"):
+        events = old.get(hand, {}).get("Events")
+        if events and hand in new:
+            new[hand]["Events"] = events + new[hand].get("Events", [])
+
+
+class LocalPublisher:
+    """
+    Class LocalPublisher:
+
+    Hands frames straight to the socket server running in this process instead of connecting to it over
+    ws://localhost, so there's no serialise -> socket -> parse round trip per frame. Has the same send_message as
+    WebSocketManager so the tracker doesn't care which one it's given. WebSocketManager is still there for when the
+    tracker and the server run on different machines.
+
+    If the server's loop falls behind only the newest frame from each source is kept, older ones are counted in
+    dropped. Any dynamic gesture events in a dropped frame are moved to the one that replaced it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = dict()  # source id -> newest frame from it that hasn't been broadcast yet
+        self._scheduled = False
+        self.published = 0
+        self.dropped = 0
+
+    def start(self, timeout=None):
+        # wait for the server to be up, so the first frames don't get dropped
+        return SocketServer.server_ready.wait(timeout)
+
+    def send_message(self, message):
+        # called from the tracker's thread, message is a frame dict or a json string
+        if not SocketServer.server_ready.is_set():
+            self.dropped += 1
+            PUBLISHER_DROPPED.inc()
+            return
+
+        # frames from different cameras mustn't replace each other, see TrackerSupervisor
+        source = message.get("Source") if isinstance(message, dict) else None
+        with self._lock:
+            if source in self._pending:
+                self.dropped += 1
+                PUBLISHER_DROPPED.inc()
+                _carry_events(self._pending[source], message)
+            self._pending[source] = message
+            if self._scheduled:
+                return  # the server will pick up the newest frame when it gets to it
+            self._scheduled = True
+        SocketServer.server_loop.call_soon_threadsafe(self._publish)
+
+    def _publish(self):
+        # runs on the server's event loop
+        with self._lock:
+            messages, self._pending, self._scheduled = self._pending, dict(), False
+
+        for message in messages.values():
+            data = json.loads(message) if isinstance(message, str) else message
+            SocketServer.broadcast_frame(data, None)
+            self.published += 1
+
+    def stop(self):
+        pass
+
+
+# its a global singleton, like websocket_manager
+local_publisher = LocalPublisher()
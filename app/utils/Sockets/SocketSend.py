@@ -1,12 +1,26 @@
 import asyncio
+import json
 import threading
 import collections
 import time
-from queue import Queue
 
 import websockets
 import websockets.protocol
 
+from .BinaryFrames import BinaryFrameEncoder
+from .. import metrics
+
+SERIALISATION_TIME = metrics.registry.histogram("handtracking_serialisation_seconds",
+                                                "Time spent turning frames into json or binary messages",
+                                                side="tracker")
+SEND_QUEUE_WAIT = metrics.registry.histogram("handtracking_send_queue_wait_seconds",
+                                             "Time frames wait in the tracker's send queue")
+SEND_QUEUE_DROPPED = metrics.registry.counter("handtracking_frames_dropped_total",
+                                              "Frames thrown away because a later stage couldn't keep up",
+                                              stage="send_queue")
+BYTES_SENT = metrics.registry.counter("handtracking_bytes_sent_total", "Bytes of frames sent over websockets",
+                                      side="tracker")
+
 
 class WebSocketClient:
     _instance = None
@@ -21,8 +35,11 @@ class WebSocketClient:
         if not hasattr(self, 'websocket_client'):
             self.websocket_client = None
         self.uri = "ws://localhost:8765"
+        if not hasattr(self, 'wire_format'):
+            self.wire_format = "json"  # or "binary", see BinaryFrames
+            self.encoder = BinaryFrameEncoder()
+            self._table_size_sent = 0  # how many gesture codes the server knows about
 
-        self.message_queue = collections.deque()
         self.max_messages_per_window = 70
         self.window_size = 1
         self.message_interval = 1 / self.max_messages_per_window
@@ -60,11 +77,24 @@ class WebSocketClient:
             )
             print(f"connected to {uri}")
             self._start_connection_timer()
+            # handshake with no preferences, the tracker only sends frames and doesn't want any back
+            await self.websocket_client.send(":;binary" if self.wire_format == "binary" else ":")
+            self._table_size_sent = 0  # the server starts a new decoder for every connection
         except Exception as e:
             print(f"connection error: {e} retrying...")
             await asyncio.sleep(2)
             await self.connect(uri)
 
+    def encode(self, message):
+        """
+        :param message: dict frame, or str json
+        :return: str or bytes to put on the wire in self.wire_format
+        """
+        if self.wire_format == "binary":
+            data = json.loads(message) if isinstance(message, str) else message
+            return self.encoder.encode(data)
+        return message if isinstance(message, str) else json.dumps(message)
+
     async def send_socket_message(self, json_data):
         if self.websocket_client is not None:
             try:
@@ -73,7 +103,14 @@ class WebSocketClient:
                     print("websocket closed reconnecting...")
                     await self.connect(self.uri)
 
-                await self.websocket_client.send(json_data)
+                with SERIALISATION_TIME.time():
+                    payload = self.encode(json_data)
+                if self.wire_format == "binary" and len(self.encoder.gestures) != self._table_size_sent:
+                    # the server needs the gesture codes before a frame that uses them
+                    await self.websocket_client.send(self.encoder.get_table_message())
+                    self._table_size_sent = len(self.encoder.gestures)
+                await self.websocket_client.send(payload)
+                BYTES_SENT.inc(metrics.payload_size(payload))
                 # await self.websocket_client.ping()
                 # print(f"sent message: {json_data}")
             except Exception as e:
@@ -82,10 +119,112 @@ class WebSocketClient:
             print("websocket is not connected")
 
 
+class SendQueue:
+    """
+    Class SendQueue:
+
+    Bounded, thread safe hand-off from the tracker to the websocket thread's event loop. put() can be called from any
+    thread and wakes the sender straight away instead of it polling.
+
+    Attributes
+    ----------
+    maxsize : int, most messages kept waiting
+    drop_policy : str, "drop-oldest" throws away the oldest waiting message when full, "latest-only" only ever
+                  keeps the newest message
+    dropped : int, messages thrown away so far
+
+    Methods
+    -------
+    configure(maxsize=None, drop_policy=None):
+        Changes the size limit or drop policy
+    bind(loop):
+        Attaches the event loop that get() runs on
+    put(message):
+        Adds a message, from any thread
+    get():
+        Coroutine, waits for the next message
+    """
+
+    DROP_POLICIES = ("drop-oldest", "latest-only")
+
+    def __init__(self, maxsize=8, drop_policy="drop-oldest"):
+        self.configure(maxsize, drop_policy)
+        self.dropped = 0
+        self._messages = collections.deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    def configure(self, maxsize=None, drop_policy=None):
+        if drop_policy is not None:
+            if drop_policy not in self.DROP_POLICIES:
+                raise ValueError(f"drop_policy must be one of {self.DROP_POLICIES}, got {drop_policy!r}")
+            self.drop_policy = drop_policy
+        if maxsize is not None:
+            self.maxsize = max(1, maxsize)
+
+    def bind(self, loop):
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def put(self, message):
+        with self._lock:
+            dropped = self.dropped
+            if self.drop_policy == "latest-only":
+                self.dropped += len(self._messages)
+                self._messages.clear()
+            elif len(self._messages) >= self.maxsize:
+                self._messages.popleft()
+                self.dropped += 1
+            self._messages.append((message, time.perf_counter()))
+            SEND_QUEUE_DROPPED.inc(self.dropped - dropped)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def get(self):
+        while True:
+            # clear before checking, a put() landing in between schedules set() after this and still wakes us
+            self._wakeup.clear()
+            with self._lock:
+                if self._messages:
+                    message, queued = self._messages.popleft()
+                    SEND_QUEUE_WAIT.observe(time.perf_counter() - queued)
+                    return message
+            await self._wakeup.wait()
+
+
+class TokenBucket:
+    """
+    Rate limiter, allows bursts of up to capacity messages and rate messages per second after that
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._last_refill = time.perf_counter()
+
+    async def acquire(self):
+        while True:
+            now = time.perf_counter()
+            self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
 class WebSocketThread:
-    def __init__(self):
+    def __init__(self, max_queue_size=8, drop_policy="drop-oldest"):
         self.client = WebSocketClient()
-        self.message_queue = Queue()
+        self.message_queue = SendQueue(max_queue_size, drop_policy)
+        # actually enforce the client's max_messages_per_window instead of just defining it
+        self.rate_limiter = TokenBucket(self.client.max_messages_per_window / self.client.window_size,
+                                        self.client.max_messages_per_window)
         self.loop = None
         self.thread = threading.Thread(target=self._start_async_loop, daemon=True)
 
@@ -97,17 +236,17 @@ class WebSocketThread:
         # initialize and run the asyncio event loop
         asyncio.set_event_loop(asyncio.new_event_loop())
         self.loop = asyncio.get_event_loop()
+        self.message_queue.bind(self.loop)
         self.loop.run_until_complete(self.client.initialize())
         self.loop.create_task(self._process_messages())
         self.loop.run_forever()
 
     async def _process_messages(self):
-        # continuously check the queue and send messages
+        # send messages as soon as they're queued, as fast as the rate limit allows
         while True:
-            if not self.message_queue.empty():
-                message = self.message_queue.get()
-                await self.client.send_socket_message(message)
-            await asyncio.sleep(0.01)  # small delay to prevent busy waiting
+            message = await self.message_queue.get()
+            await self.rate_limiter.acquire()
+            await self.client.send_socket_message(message)
 
     def send_message(self, message):
         # put a message into the queue to be sent by the websocket client
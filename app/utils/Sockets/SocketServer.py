@@ -1,10 +1,52 @@
 import asyncio
 import json
+import threading
+import time
+from http import HTTPStatus
 
 import websockets
 import traceback
 
+from .BinaryFrames import BinaryFrameDecoder, BinaryFrameEncoder, is_table_message
+from .DeltaStream import DeltaStreamEncoder
+from .ClientWriter import ClientWriter
+from .Subscriptions import SubscriptionError, get_subscription
+from .. import metrics
+
 connected_clients = dict()
+client_formats = dict()  # client -> "json", "binary" or "delta", negotiated in the handshake
+delta_streams = dict()  # client -> DeltaStreamEncoder, for clients using the delta format
+client_writers = dict()  # client -> ClientWriter, every subscriber's own outbound queue
+client_sources = dict()  # client -> set of source ids it subscribed to, clients that didn't pick get every source
+client_rates = dict()  # client -> (max frames per second or None, gesture changes only), see parse_delivery
+
+# the shared clock clients with a max rate are downsampled on: frame rate -> source -> the last tick of that rate a
+# frame went out in. Every client with the same rate gets the same frames, so it's one check per rate per frame
+# however many clients there are, and no timers
+rate_ticks = dict()
+last_gestures = dict()  # source -> (left gesture, right gesture) of the last frame, for gesture change only clients
+
+# how many frames can wait for a slow client before older ones are dropped, and how long (seconds) a client can
+# stay behind before it's disconnected, see ClientWriter
+client_queue_size = 1
+max_client_lag = 5.0
+frame_decoders = dict()  # client -> BinaryFrameDecoder, for senders (the tracker) that send binary frames
+binary_encoder = BinaryFrameEncoder()  # shared so every binary client sees the same gesture code table
+
+server_loop = None  # the event loop the server runs on, for LocalPublisher to hand frames to
+server_ready = threading.Event()
+
+FAN_OUT_TIME = metrics.registry.histogram("handtracking_fan_out_seconds",
+                                          "Time the server takes to hand a frame to every subscriber's queue")
+SERIALISATION_TIME = metrics.registry.histogram("handtracking_serialisation_seconds",
+                                                "Time spent turning frames into json or binary messages",
+                                                side="server")
+CAPTURE_TO_SERVER = metrics.registry.histogram("handtracking_latency_seconds",
+                                               "Time from a frame being captured to it reaching each hop",
+                                               hop="capture_to_server")
+FRAMES_RECEIVED = metrics.registry.counter("handtracking_frames_received_total", "Frames the server has broadcast")
+metrics.registry.gauge("handtracking_connected_clients", "Clients connected to the server",
+                       function=lambda: len(connected_clients))
 
 
 # so for each client i need to know what it like actually wants. Each client needs to be attributed to a piece of data where it says what type of data the server should send it
@@ -24,6 +66,193 @@ def set_client_prefs(client, data_types):
 def remove_client(client):
     if client in connected_clients:
         connected_clients.pop(client, None)
+    client_formats.pop(client, None)
+    client_sources.pop(client, None)
+    client_rates.pop(client, None)
+    frame_decoders.pop(client, None)
+    delta_streams.pop(client, None)
+    writer = client_writers.pop(client, None)
+    if writer is not None:
+        writer.close()
+
+
+def parse_handshake(initial_message):
+    """
+    :param initial_message: str, e.g. ":101", ":111;binary", ":111;delta,precision=2", ":111;source=front+side"
+        ":111;rate=5" or ":001;changes"
+    :return: (preferences, wire format, dict of any other options)
+    """
+    preferences, _, option_str = initial_message.split(":", 1)[1].partition(";")  # extract preferences
+    options = {}
+    for option in filter(None, option_str.split(",")):
+        key, _, value = option.partition("=")
+        options[key.strip()] = value.strip()
+    wire_format = "binary" if "binary" in options else "delta" if "delta" in options else "json"
+    return preferences, wire_format, options
+
+
+def parse_delivery(options):
+    """
+    :param options: dict of handshake options, e.g. from ":111;rate=2" or ":001;changes"
+    :return: (max frames per second or None, gesture changes only), or None to get every frame. Gesture changes
+        are always sent as they happen, so with changes any rate is ignored, and frames with dynamic gesture events
+        go past the rate
+    """
+    rate = float(options["rate"]) if options.get("rate") else None
+    if rate is not None and rate <= 0:
+        raise ValueError("rate must be more than 0")
+    changes = "changes" in options
+    if rate is None and not changes:
+        return None
+    return rate, changes
+
+
+def parse_message(message, sender):
+    """
+    :param message: str or bytes from a sender
+    :param sender: the client it came from
+    :return: dict frame, or None if it wasn't a frame (gesture table updates, garbage)
+    """
+    try:
+        if isinstance(message, bytes):
+            if sender not in frame_decoders:
+                frame_decoders[sender] = BinaryFrameDecoder()
+            return frame_decoders[sender].decode(message)
+
+        # Convert JSON string to Python object
+        data = json.loads(message)
+    except ValueError as e:
+        print(f"Ignoring message that isn't a valid frame ({e}): {message[:50]!r}")
+        return None
+
+    if is_table_message(data):
+        # the sender is about to send binary frames, keep its gesture codes
+        if sender not in frame_decoders:
+            frame_decoders[sender] = BinaryFrameDecoder()
+        frame_decoders[sender].update_table(data)
+        return None
+    if not (isinstance(data, dict) and all(isinstance(data.get(hand), dict) for hand in ("Left", "Right"))):
+        # valid json but not a frame, e.g. a number or a list, broadcasting it would fail on every projection
+        print(f"Ignoring message that isn't a frame: {message[:50]!r}")
+        return None
+    return data
+
+
+def project_for_preferences(data, preferences_str):
+    """
+    :param data: dict, parsed tracker message
+    :param preferences_str: str, client preferences e.g. "101" (landmarks, orientation, gesture) or a json
+                            subscription, see Subscriptions
+    :return: dict, only the parts of the frame that client asked for
+    """
+    # compiled once per distinct subscription and cached, so this is a dict lookup and the projection itself
+    return get_subscription(preferences_str).project(data)
+
+
+def render_for_preferences(data, preferences_str):
+    """
+    :return: str, the json a client with these preferences gets sent
+    """
+    return json.dumps(project_for_preferences(data, preferences_str))
+
+
+def broadcast_frame(data, sender):
+    """
+    Sends a tracker frame to every other client. Each distinct (preferences, wire format) rendering of the frame is
+    built once and goes out to all the clients that asked for it in one broadcast
+
+    :param data: dict, the parsed frame, see parse_message
+    :param sender: the client the frame came from, it doesn't get a copy
+    """
+    FRAMES_RECEIVED.inc()
+    if "Captured" in data:
+        CAPTURE_TO_SERVER.observe(time.time() - data["Captured"])
+    with FAN_OUT_TIME.time():
+        _broadcast_frame(data, sender)
+
+
+def _is_due(rate, source, now, due):
+    # True if a client with this max rate should get the frame, worked out once per rate per frame and kept in due
+    if rate not in due:
+        tick = int(now * rate)
+        ticks = rate_ticks.setdefault(rate, {})
+        due[rate] = ticks.get(source) != tick
+        ticks[source] = tick
+    return due[rate]
+
+
+def _broadcast_frame(data, sender):
+    source = data.get("Source")
+    now = time.monotonic()
+    gestures = (data.get("Left", {}).get("Gesture"), data.get("Right", {}).get("Gesture"))
+    # a frame with dynamic gesture events is as important to change only clients as a new gesture
+    has_events = any("Events" in data.get(hand, {}) for hand in ("Left", "Right"))
+    gesture_changed = has_events or last_gestures.get(source) != gestures
+    last_gestures[source] = gestures
+    due = {}
+
+    # group the clients by what they want so each version of the frame only gets built once
+    subscribers = {}
+    for ListClient, preferences in connected_clients.items():
+        if ListClient in client_sources and source not in client_sources[ListClient]:
+            continue  # subscribed to other cameras
+        if ListClient == sender or not preferences:
+            continue
+        delivery = client_rates.get(ListClient)
+        changes_only = False
+        if delivery is not None:
+            rate, changes_only = delivery
+            if changes_only and not gesture_changed:
+                continue
+            if not changes_only and not _is_due(rate, source, now, due) and not has_events:
+                # downsampled, this frame isn't in a new tick of the client's rate. Frames with events go out
+                # anyway, an event is only in the one frame and a rate limited client would never see it otherwise
+                continue
+        # gesture changes and events are rare and the client would miss them for good if one was dropped
+        key = (preferences, client_formats.get(ListClient, "json"), changes_only or has_events)
+        subscribers.setdefault(key, []).append(ListClient)
+    if not subscribers:
+        return
+
+    binary_clients = [c for (_, wire_format, _), clients in subscribers.items() if wire_format == "binary"
+                      for c in clients]
+    captured = data.get("Captured")
+    if binary_clients:
+        sequence = data["Sequence"] & 0xFFFFFFFF if "Sequence" in data else binary_encoder.next_sequence()
+        if binary_encoder.add_gestures(data):
+            # new gesture name, binary clients need the new code before they get a frame using it. Every binary
+            # client gets the table, not just this frame's, one skipped for its rate or source would otherwise
+            # get a later frame using the code without ever having seen it
+            table = binary_encoder.get_table_message()
+            for ListClient, wire_format in client_formats.items():
+                if wire_format == "binary" and ListClient in client_writers:
+                    client_writers[ListClient].push(table, droppable=False)
+
+    for (preferences_str, wire_format, reliable), clients in subscribers.items():
+        if wire_format == "delta":
+            # the projection is shared, but every delta client is relative to its own keyframe
+            projected = project_for_preferences(data, preferences_str)
+            for ListClient in clients:
+                stream = delta_streams[ListClient]
+                with SERIALISATION_TIME.time():
+                    payload = stream.encode(projected)
+                # a dropped keyframe would leave the client applying deltas to the wrong frame, but a newer one
+                # makes a keyframe still waiting to go out, and the deltas queued before it, useless
+                client_writers[ListClient].push(payload, droppable=not (stream.sent_keyframe or reliable),
+                                                captured=captured,
+                                                key="keyframe" if stream.sent_keyframe else None)
+            continue
+
+        with SERIALISATION_TIME.time():
+            if wire_format == "binary":
+                # binary frames only have whole fields, not landmark subsets
+                payload = binary_encoder.encode(data, get_subscription(preferences_str).preferences, sequence)
+            else:
+                payload = render_for_preferences(data, preferences_str)
+
+        # the same payload object goes into every queue, each client's writer sends it when that client is ready
+        for ListClient in clients:
+            client_writers[ListClient].push(payload, droppable=not reliable, captured=captured)
 
 
 async def echo(client):
@@ -36,10 +265,40 @@ async def echo(client):
             print(f"Received string message: {initial_message}")
 
         # check if the message is a valid handshake
-        if initial_message.startswith(":"):
-            preferences = initial_message.split(":", 1)[1]  # extract preferences
+        if isinstance(initial_message, str) and initial_message.startswith(":"):
+            preferences, wire_format, options = parse_handshake(initial_message)
+            if preferences:
+                try:
+                    # checked and compiled once here, clients asking for the same thing end up with the same key
+                    preferences = get_subscription(preferences).key
+                except SubscriptionError as e:
+                    print(f"Client {client} sent an invalid subscription: {e}")
+                    await client.close(1008, str(e)[:120])  # 1008 is "policy violation"
+                    return
+            try:
+                delivery = parse_delivery(options)
+                # settings are checked before the client is registered, so a bad one can't leave it half set up
+                delta_stream = DeltaStreamEncoder.from_options(options) if wire_format == "delta" else None
+            except ValueError as e:
+                print(f"Client {client} sent invalid options: {e}")
+                await client.close(1008, str(e)[:120])
+                return
             add_client(client, preferences)
-            print(f"Client {client} connected with preferences: {connected_clients[client]}")
+            client_formats[client] = wire_format
+            if delivery is not None:
+                # a max rate (";rate=2") and/or gesture changes only (";changes"), see _broadcast_frame
+                client_rates[client] = delivery
+            if options.get("source"):
+                # delta streams diff against one camera's keyframes, so with several cameras delta clients should
+                # always pick one
+                client_sources[client] = set(options["source"].split("+"))
+            if delta_stream is not None:
+                delta_streams[client] = delta_stream
+            if preferences:
+                client_writers[client] = ClientWriter(client, client_queue_size, max_client_lag)
+            print(f"Client {client} connected with preferences: {connected_clients[client]} ({wire_format})")
+            if wire_format == "binary" and preferences:
+                client_writers[client].push(binary_encoder.get_table_message(), droppable=False)
 
         while True:
             try:
@@ -53,60 +312,15 @@ async def echo(client):
             if message == "ping":
                 await client.pong()
                 print("Sent pong.")
+            elif isinstance(message, str) and message.startswith("ack:"):
+                # delta clients acknowledging a keyframe
+                if client in delta_streams and message[4:].isdigit():
+                    delta_streams[client].acknowledge(int(message[4:]))
             else:
                 # broadcast the message to all other clients
-                for ListClient in connected_clients:
-                    if ListClient != client:
-                        preferences = connected_clients[ListClient]
-
-                        if preferences:
-                            # client is known and has preferences
-                            preferences_str = preferences  # take the single preference string
-
-                            # Convert JSON string to Python object
-                            # Convert the string to a Python dictionary
-                            data = json.loads(message)
-
-                            # Accessing the Left and Right hand data
-                            left_hand = data["Left"]
-                            right_hand = data["Right"]
-
-                            # For Left hand
-                            left_landmarks = left_hand["Landmarks"]
-                            left_gesture = left_hand["Gesture"]
-                            left_orientation = left_hand["Orientation"]
-
-                            # For Right hand
-                            right_landmarks = right_hand["Landmarks"]
-                            right_gesture = right_hand["Gesture"]
-                            right_orientation = right_hand["Orientation"]
-
-                            # Prepare the sections
-                            left_hand = {}
-                            if preferences_str[0] == '1':
-                                left_hand["Landmarks"] = left_landmarks if left_landmarks != "None" else None
-                            if preferences_str[1] == '1':
-                                left_hand["Orientation"] = left_orientation if left_orientation != "None" else None
-                            if preferences_str[2] == '1':
-                                left_hand["Gesture"] = left_gesture if left_gesture != "None" else None
-
-                            right_hand = {}
-                            if preferences_str[0] == '1':
-                                right_hand["Landmarks"] = right_landmarks if right_landmarks != "None" else None
-                            if preferences_str[1] == '1':
-                                right_hand["Orientation"] = right_orientation if right_orientation != "None" else None
-                            if preferences_str[2] == '1':
-                                right_hand["Gesture"] = right_gesture if right_gesture != "None" else None
-
-                            # Construct the final output JSON, removing keys with None values
-                            output = {
-                                "Left": {key: value for key, value in left_hand.items() if value is not None},
-                                "Right": {key: value for key, value in right_hand.items() if value is not None}
-                            }
-
-                            # Printing the requested sections as formatted JSON
-                            # print(json.dumps(output, indent=4))
-                            await ListClient.send(json.dumps(output))
+                data = parse_message(message, client)
+                if data is not None:
+                    broadcast_frame(data, client)
                 # await client.send(f"Echo: {message}")
 
     except websockets.ConnectionClosed:
@@ -115,14 +329,48 @@ async def echo(client):
         remove_client(client)
 
 
-async def main():
+def serve_metrics(connection, request):
+    """
+    Answers plain http GET /metrics on the websocket port with every metric in the Prometheus text format, anything
+    else carries on as a websocket handshake
+    """
+    if request.path == "/metrics":
+        return connection.respond(HTTPStatus.OK, metrics.registry.render())
+    return None
+
+
+async def main(host="localhost", port=8765, reuse_port=False, startup=None):
+    """
+    :param reuse_port: bool, let other processes listen on the same port (SO_REUSEPORT), see ServerWorkerPool
+    :param startup: metrics.StartupTimer, reported once the server is listening
+    """
+    global server_loop
     print("Socket Server Starting")
-    async with websockets.serve(echo, "localhost", 8765, ping_interval=None, ping_timeout=None):
+    async with websockets.serve(echo, host, port, ping_interval=None, ping_timeout=None,
+                                process_request=serve_metrics, reuse_port=reuse_port or None):
+        server_loop = asyncio.get_running_loop()
+        server_ready.set()  # in-process publishers can start handing frames over now
+        if startup is not None:
+            startup.mark("listening")
+            startup.report()
         await asyncio.Future()  # run server indefinitely
 
 
-def start_socket_server():
-    asyncio.run(main())
+def start_socket_server(queue_size=None, max_lag=None, host="localhost", port=8765, reuse_port=False):
+    """
+    :param queue_size: int, frames kept for a slow client before the oldest is dropped
+    :param max_lag: float, seconds a client can stay behind before it's disconnected
+    :param host: str, interface to listen on
+    :param port: int, port to listen on
+    :param reuse_port: bool, share the port with other server processes, see ServerWorkerPool
+    """
+    global client_queue_size, max_client_lag
+    startup = metrics.StartupTimer("server")
+    if queue_size is not None:
+        client_queue_size = queue_size
+    if max_lag is not None:
+        max_client_lag = max_lag
+    asyncio.run(main(host, port, reuse_port, startup))
 
 
 if __name__ == "__main__":
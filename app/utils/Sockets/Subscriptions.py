@@ -0,0 +1,181 @@
+import collections
+import json
+
+# What a client wants sent, given in its handshake in place of the old 3 character preferences. Either the old form,
+# ":101" (landmarks, orientation, gesture, for both hands), or a json object per hand and field, e.g.
+#   :{"Right": {"Landmarks": "fingertips", "Gesture": true}}
+#   :{"Left": {"Landmarks": [0, 4, 8]}, "Right": {"Landmarks": "all", "Orientation": true}};delta
+# Landmarks can be true/"all", the name of one of LANDMARK_SETS, or a list of landmark indices. Hands that aren't
+# mentioned aren't sent at all.
+#
+# Every spec is checked once, at the handshake, and compiled into a projection function. Functions are cached by
+# the spec's canonical form, so clients asking for the same thing share one and the server never looks at spec
+# strings while broadcasting.
+
+HANDS = ("Left", "Right")
+FIELDS = ("Landmarks", "Orientation", "Gesture")
+LANDMARK_SETS = {
+    "all": tuple(range(21)),
+    "wrist": (0,),
+    "fingertips": (4, 8, 12, 16, 20),
+    "knuckles": (1, 5, 9, 13, 17),
+    "thumb": (1, 2, 3, 4),
+    "index": (5, 6, 7, 8),
+    "middle": (9, 10, 11, 12),
+    "ring": (13, 14, 15, 16),
+    "pinky": (17, 18, 19, 20),
+}
+# passed through untouched whatever the subscription, see project_for_preferences
+FRAME_FIELDS = ("Predicted", "Source", "Sequence", "Captured")
+
+
+class SubscriptionError(ValueError):
+    pass
+
+
+def parse_subscription(text):
+    """
+    :param text: str, the preferences part of a handshake
+    :return: dict, hand -> {field: True, or "Landmarks": tuple of indices}, only what was asked for
+    """
+    if len(text) == len(FIELDS) and set(text) <= {"0", "1"}:
+        # the old positional form, same fields for both hands
+        fields = {field: True for field, flag in zip(FIELDS, text) if flag == "1"}
+        if "Landmarks" in fields:
+            fields["Landmarks"] = LANDMARK_SETS["all"]
+        return {hand: dict(fields) for hand in HANDS}
+
+    try:
+        raw = json.loads(text)
+    except ValueError:
+        raise SubscriptionError(f"preferences must be 3 digits like 101 or a json object, got {text[:50]!r}")
+    if not isinstance(raw, dict):
+        raise SubscriptionError("subscription must be a json object of hands")
+
+    spec = {}
+    for hand, fields in raw.items():
+        if hand not in HANDS:
+            raise SubscriptionError(f"unknown hand {hand!r}, expected one of {HANDS}")
+        if not isinstance(fields, dict):
+            raise SubscriptionError(f"{hand} must be an object of fields")
+        spec[hand] = {}
+        for field, value in fields.items():
+            if field not in FIELDS:
+                raise SubscriptionError(f"unknown field {field!r}, expected one of {FIELDS}")
+            if field == "Landmarks":
+                points = _parse_landmarks(value)
+                if points:
+                    spec[hand][field] = points
+            elif not isinstance(value, bool):
+                raise SubscriptionError(f"{hand}.{field} must be true or false")
+            elif value:
+                spec[hand][field] = True
+    return spec
+
+
+def _parse_landmarks(value):
+    if value is False:
+        return ()
+    if value is True:
+        return LANDMARK_SETS["all"]
+    if isinstance(value, str):
+        if value not in LANDMARK_SETS:
+            raise SubscriptionError(f"unknown landmark set {value!r}, expected one of {tuple(LANDMARK_SETS)}")
+        return LANDMARK_SETS[value]
+    if isinstance(value, list) and all(isinstance(i, int) and 0 <= i < 21 for i in value):
+        return tuple(sorted(set(value)))
+    raise SubscriptionError("Landmarks must be true, a landmark set name or a list of indices 0-20")
+
+
+class Subscription:
+    """
+    Class Subscription:
+
+    A checked subscription spec and the projection compiled from it. Get them from get_subscription, which caches
+    them, rather than making them directly.
+
+    Attributes
+    ----------
+    spec : dict, see parse_subscription
+    key : str, canonical form of the spec, the same for every way of writing the same subscription
+    preferences : str, the nearest old style "101" preferences, for binary frames which only have whole fields
+    project : function taking a frame dict and returning only the parts of it this subscription wants
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.key = json.dumps({hand: {field: list(value) if field == "Landmarks" else value
+                                      for field, value in sorted(fields.items())}
+                               for hand, fields in sorted(spec.items())}, separators=(",", ":"))
+        self.preferences = "".join("1" if any(field in fields for fields in spec.values()) else "0"
+                                   for field in FIELDS)
+        self.project = self._compile()
+
+    def _compile(self):
+        plans = []
+        for hand, fields in self.spec.items():
+            points = fields.get("Landmarks")
+            every_point = points == LANDMARK_SETS["all"]
+            string_points = tuple(str(i) for i in points) if points else ()
+            plans.append((hand, points, every_point, string_points,
+                          "Orientation" in fields, "Gesture" in fields))
+
+        def project(data):
+            output = {}
+            for hand, points, every_point, string_points, orientation, gesture in plans:
+                hand_data = data[hand]
+                projected = {}
+                if points:
+                    landmarks = hand_data["Landmarks"]
+                    if landmarks != "None" and landmarks is not None:
+                        if every_point:
+                            projected["Landmarks"] = landmarks
+                        elif 0 in landmarks:  # int keys straight from the tracker
+                            projected["Landmarks"] = {i: landmarks[i] for i in points}
+                        else:  # string keys, the frame went through json on the way here
+                            projected["Landmarks"] = {i: landmarks[i] for i in string_points}
+                if orientation and hand_data["Orientation"] != "None":
+                    projected["Orientation"] = hand_data["Orientation"]
+                if gesture and hand_data["Gesture"] != "None":
+                    projected["Gesture"] = hand_data["Gesture"]
+                if gesture and "Events" in hand_data:
+                    projected["Events"] = hand_data["Events"]  # dynamic gestures go to anyone after gestures
+                output[hand] = projected
+            for key in FRAME_FIELDS:
+                if key in data:
+                    output[key] = data[key]
+            return output
+
+        return project
+
+
+# preferences as written, and canonical keys -> Subscription, least recently used first. Clients choose what they
+# send, so it's bounded, otherwise varying the handshake would grow it forever
+_subscriptions = collections.OrderedDict()
+MAX_CACHED_SUBSCRIPTIONS = 1024
+
+
+def _cache(text, subscription):
+    _subscriptions[text] = subscription
+    _subscriptions.move_to_end(text)
+    while len(_subscriptions) > MAX_CACHED_SUBSCRIPTIONS:
+        _subscriptions.popitem(last=False)
+
+
+def get_subscription(text):
+    """
+    :param text: str, preferences from a handshake or a Subscription.key
+    :return: Subscription, the same object for every spec that means the same thing while it's cached
+    :raises SubscriptionError: if the spec isn't valid
+    """
+    subscription = _subscriptions.get(text)
+    if subscription is not None:
+        _subscriptions.move_to_end(text)
+        return subscription
+
+    subscription = Subscription(parse_subscription(text))
+    # specs written differently but meaning the same thing share the compiled projection
+    subscription = _subscriptions.get(subscription.key, subscription)
+    _cache(subscription.key, subscription)
+    _cache(text, subscription)
+    return subscription
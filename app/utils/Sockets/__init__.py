@@ -1,3 +1,5 @@
 from .SocketServer import start_socket_server
 from .SocketSend import WebSocketThread
 from .SocketManager import websocket_manager
+from .SocketPublish import local_publisher
+from .ServerWorkers import ServerWorkerPool
@@ -1,2 +1,20 @@
-from .Sockets import start_socket_server
-from .HandTracking import main
+import importlib
+
+# imported when they're first used rather than with the package, so e.g. running the socket server on its own
+# never loads cv2 or mediapipe
+_EXPORTS = {
+    "start_socket_server": ".Sockets",
+    "main": ".HandTracking",
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value  # only looked up the first time
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,241 @@
+import bisect
+import threading
+import time
+
+# Lightweight metrics shared by the tracker and the socket server, rendered in the Prometheus text format on
+# ws://localhost:8765/metrics (plain http, see SocketServer.serve_metrics). Recording is a couple of list/float
+# updates with no locks, so it's left on all the time. Under heavy contention between threads a count can
+# occasionally be lost, which is fine for metrics.
+#
+# Metrics live in the process that records them: with TrackerSupervisor the tracker stages happen in the worker
+# processes, so only the server side metrics show up in the supervisor's endpoint. With ServerWorkerPool it's the
+# other way round, the server runs in the workers, so the tracker serves its own metrics with start_metrics_server.
+
+# seconds, from half a millisecond (serialising one frame) up to a couple of seconds (a stuck client)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self, name):
+        return [f"{name}{_format_labels(self.labels)} {self.value}"]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, labels, function=None):
+        """
+        :param function: called whenever the gauge is rendered, instead of keeping a value
+        """
+        self.labels = labels
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name):
+        value = self.function() if self.function is not None else self.value
+        return [f"{name}{_format_labels(self.labels)} {value}"]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, labels, buckets=DEFAULT_BUCKETS):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """
+        Times a block of code, with metrics.histogram(...).time(): ...
+        """
+        return _Timer(self)
+
+    def render(self, name):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(self.labels, {'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(self.labels)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(self.labels)} {self.count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class MetricsRegistry:
+    """
+    Class MetricsRegistry:
+
+    Every metric the app records, by name and labels. Asking for a metric that already exists returns it, so
+    modules can just ask for theirs when they're imported
+
+    Methods
+    -------
+    counter(name, help_text, **labels):
+        Something that only goes up, e.g. frames dropped
+    gauge(name, help_text, function=None, **labels):
+        Something that goes up and down, e.g. connected clients
+    histogram(name, help_text, buckets=DEFAULT_BUCKETS, **labels):
+        Distribution of durations, e.g. inference time
+    render():
+        Everything in the Prometheus text format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = dict()  # name -> (kind, help text, {labels tuple: metric})
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        with self._lock:
+            kind, _, series = self._metrics.setdefault(name, (cls.kind, help_text, dict()))
+            if kind != cls.kind:
+                raise ValueError(f"metric {name} is already a {kind}")
+            key = tuple(sorted(labels.items()))
+            if key not in series:
+                series[key] = cls(labels, **kwargs)
+            return series[key]
+
+    def counter(self, name, help_text, **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, function=None, **labels):
+        return self._get(Gauge, name, help_text, labels, function=function)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = [(name, kind, help_text, list(series.values()))
+                       for name, (kind, help_text, series) in self._metrics.items()]
+        for name, kind, help_text, series in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in series:
+                lines.extend(metric.render(name))
+        return "\n".join(lines) + "\n"
+
+
+# its a global singleton, like websocket_manager
+registry = MetricsRegistry()
+
+
+def payload_size(payload):
+    """
+    :param payload: str or bytes websocket message
+    :return: int, bytes it takes on the wire, text messages are sent as utf-8
+    """
+    # isascii is a flag check, so the usual all ascii json never gets encoded twice
+    if isinstance(payload, str) and not payload.isascii():
+        return len(payload.encode())
+    return len(payload)
+
+
+def start_metrics_server(host="localhost", port=8766):
+    """
+    Serves GET /metrics over plain http on a port of its own, from a daemon thread, for a process that records
+    metrics but doesn't run the socket server
+
+    :param host: str, interface to listen on
+    :param port: int, port to listen on
+    :return: http.server.ThreadingHTTPServer, call shutdown() to stop it
+    """
+    # only imported here, most processes serve their metrics from the socket server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scraped every few seconds, not worth a line each time
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+class StartupTimer:
+    """
+    Class StartupTimer:
+
+    Times each step of starting a component up, since a restarted tracker or server is down for as long as starting
+    takes. Every step is kept as handtracking_startup_seconds{component, stage} and report() prints them all.
+
+    Methods
+    -------
+    mark(stage):
+        Ends a step, it took the time since the last mark (or since the timer was made)
+    report():
+        Prints how long starting up took and what it was spent on
+    """
+
+    def __init__(self, component):
+        """
+        :param component: str, what's starting, e.g. "tracker" or "server"
+        """
+        self.component = component
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages = []  # (stage, seconds)
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self._last))
+        registry.gauge("handtracking_startup_seconds", "Time each step of starting up took",
+                       component=self.component, stage=stage).set(now - self._last)
+        self._last = now
+
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        steps = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stages)
+        print(f"{self.component.capitalize()} started in {self.total():.2f}s ({steps})")